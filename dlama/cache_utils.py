@@ -0,0 +1,408 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler(sys.stdout)
+formatter = logging.Formatter(
+    "%(levelname)s - %(filename)s:%(funcName)s:line %(lineno)d - %(message)s"
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+DEFAULT_CACHE_DIR = str(Path("data", "cache"))
+# Wikidata keeps changing, so cached results are considered stale after a week
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_SIZE = 2 * 1024 ** 3
+# The eviction frees some space below max_size so that it isn't repeated after each write
+EVICTION_TARGET_RATIO = 0.9
+# SQLite limits the number of variables within a single statement
+SQLITE_MAX_VARIABLES = 900
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SparqlCache:
+    """An on-disk cache of SPARQL results keyed by a hash of the query text."""
+
+    def __init__(
+        self, cache_dir, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE, refresh=False
+    ):
+        """
+        Args:
+            cache_dir: The directory in which the results are stored.
+            ttl: The number of seconds after which a cached result expires (None to disable).
+            max_size: The maximum number of bytes used by the cache (None to disable).
+            refresh: Ignore the cached results and overwrite them with fresh ones.
+        """
+        self.cache_dir = Path(cache_dir, "sparql")
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # An estimate of the cache's size (computed on the first write) that avoids scanning
+        # the cache directory after each write
+        self.lock = threading.Lock()
+        self.size_estimate = None
+
+    @staticmethod
+    def normalize_query(query):
+        """Collapse whitespaces so that differently indented queries share a key."""
+        return " ".join(query.split())
+
+    def get_key(self, query):
+        return hashlib.sha256(self.normalize_query(query).encode("utf-8")).hexdigest()
+
+    def _get_path(self, key):
+        return Path(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, query):
+        """Return the cached results of a query or None if they are missing/expired."""
+        if self.refresh:
+            return None
+
+        path = self._get_path(self.get_key(query))
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl is not None and time.time() - entry["created_at"] > self.ttl:
+            logger.debug(f"Cached results of '{path.name}' expired.")
+            _remove_file(path)
+            return None
+
+        # Mark the entry as recently used for the size-bounded eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry["results"]
+
+    def set(self, query, results):
+        """Store the results of a query and evict old entries if needed."""
+        path = self._get_path(self.get_key(query))
+        os.makedirs(path.parent, exist_ok=True)
+
+        # Write to a uniquely named temporary file first to avoid leaving partial entries
+        # behind (or mixing the writes of concurrent threads/processes)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=str(path.parent), suffix=".tmp", delete=False
+        ) as f:
+            json.dump(
+                {
+                    "query": self.normalize_query(query),
+                    "created_at": time.time(),
+                    "results": results,
+                },
+                f,
+            )
+            entry_size = f.tell()
+        os.replace(f.name, str(path))
+
+        if self.max_size is None:
+            return
+
+        with self.lock:
+            if self.size_estimate is None:
+                self.size_estimate = self.get_size()
+            else:
+                self.size_estimate += entry_size
+            # Entries are only evicted once the cache seems to exceed max_size
+            if self.size_estimate > self.max_size:
+                self.size_estimate = self.evict()
+
+    def get_entries(self):
+        """Return the (modification time, size, path) of the cache's entries."""
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def get_size(self):
+        return sum([size for _, size, _ in self.get_entries()])
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits a fraction of max_size.
+
+        Returns:
+            The size of the cache after the eviction.
+        """
+        entries = self.get_entries()
+        total_size = sum([size for _, size, _ in entries])
+        if self.max_size is None:
+            return total_size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size * EVICTION_TARGET_RATIO:
+                break
+            _remove_file(path)
+            total_size -= size
+        return total_size
+
+
+class SqliteStore:
+    """A thread-safe connection to an SQLite database within the cache directory."""
+
+    # The statements creating the tables of the store
+    SCHEMA = []
+
+    def __init__(self, cache_dir, filename):
+        """
+        Args:
+            cache_dir: The directory in which the SQLite database is stored.
+            filename: The name of the database file.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            str(Path(cache_dir, filename)), check_same_thread=False
+        )
+        with self.lock, self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+
+class LabelsStore(SqliteStore):
+    """A persistent entity -> language -> label store of Wikidata labels."""
+
+    SCHEMA = [
+        # A NULL label means that the entity has no label in this language
+        "CREATE TABLE IF NOT EXISTS labels "
+        "(entity TEXT NOT NULL, lang TEXT NOT NULL, label TEXT, "
+        "PRIMARY KEY (entity, lang))"
+    ]
+
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir, "labels.sqlite")
+
+    def get_labels(self, entities, langs):
+        """Look up the stored labels of entities.
+
+        Args:
+            entities: A list of Wikidata entity IDs.
+            langs: A list of languages.
+
+        Returns:
+            A dictionary of entity -> lang -> label for the stored (entity, lang) pairs only.
+        """
+        labels = {}
+        step = SQLITE_MAX_VARIABLES - len(langs)
+        langs_placeholders = ",".join(["?"] * len(langs))
+        with self.lock:
+            for start in range(0, len(entities), step):
+                batch_entities = entities[start : start + step]
+                entities_placeholders = ",".join(["?"] * len(batch_entities))
+                rows = self.connection.execute(
+                    "SELECT entity, lang, label FROM labels "
+                    f"WHERE lang IN ({langs_placeholders}) "
+                    f"AND entity IN ({entities_placeholders})",
+                    list(langs) + list(batch_entities),
+                )
+                for entity, lang, label in rows:
+                    labels.setdefault(entity, {})[lang] = label
+        return labels
+
+    def set_labels(self, labels):
+        """Store the labels of entities.
+
+        Args:
+            labels: A dictionary of entity -> lang -> label (None for missing labels).
+        """
+        rows = [
+            (entity, lang, label)
+            for entity in labels
+            for lang, label in labels[entity].items()
+        ]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO labels (entity, lang, label) VALUES (?, ?, ?)",
+                rows,
+            )
+
+
+class ArticlesEditsStore(SqliteStore):
+    """A persistent store of the number of edits of Wikipedia articles."""
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS edits "
+        "(lang TEXT NOT NULL, url TEXT NOT NULL, edits INTEGER NOT NULL, "
+        "created_at REAL NOT NULL, PRIMARY KEY (lang, url))"
+    ]
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, refresh=False):
+        """
+        Args:
+            cache_dir: The directory in which the SQLite database is stored.
+            ttl: The number of seconds after which a stored count expires (None to disable).
+            refresh: Ignore the stored counts and overwrite them with fresh ones.
+        """
+        super().__init__(cache_dir, "edits.sqlite")
+        self.ttl = ttl
+        self.refresh = refresh
+
+    def get_edits(self, articles_urls, lang):
+        """Look up the stored number of edits of articles.
+
+        Args:
+            articles_urls: A list of urls of Wikipedia articles.
+            lang: The language of the Wikipedia articles.
+
+        Returns:
+            A dictionary of url -> number of edits for the stored unexpired urls only.
+        """
+        edits = {}
+        if self.refresh:
+            return edits
+
+        min_created_at = time.time() - self.ttl if self.ttl is not None else 0
+        step = SQLITE_MAX_VARIABLES - 2
+        with self.lock:
+            for start in range(0, len(articles_urls), step):
+                batch_urls = articles_urls[start : start + step]
+                urls_placeholders = ",".join(["?"] * len(batch_urls))
+                rows = self.connection.execute(
+                    "SELECT url, edits FROM edits "
+                    f"WHERE lang = ? AND created_at >= ? AND url IN ({urls_placeholders})",
+                    [lang, min_created_at] + list(batch_urls),
+                )
+                for url, url_edits in rows:
+                    edits[url] = url_edits
+        return edits
+
+    def set_edits(self, edits, lang):
+        """Store the number of edits of articles.
+
+        Args:
+            edits: A dictionary of url -> number of edits.
+            lang: The language of the Wikipedia articles.
+        """
+        created_at = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO edits (lang, url, edits, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(lang, url, url_edits, created_at) for url, url_edits in edits.items()],
+            )
+
+
+class HierarchyIndex(SqliteStore):
+    """A persistent index of Wikidata hierarchies (e.g.: P279, P131) and their transitive closure."""
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS edges "
+        "(property TEXT NOT NULL, child TEXT NOT NULL, parent TEXT NOT NULL, "
+        "PRIMARY KEY (property, child, parent))",
+        "CREATE TABLE IF NOT EXISTS closure "
+        "(property TEXT NOT NULL, node TEXT NOT NULL, ancestor TEXT NOT NULL, "
+        "PRIMARY KEY (property, node, ancestor))",
+        # The nodes whose ancestors are all known (including the ones without ancestors)
+        "CREATE TABLE IF NOT EXISTS expanded_nodes "
+        "(property TEXT NOT NULL, node TEXT NOT NULL, PRIMARY KEY (property, node))",
+    ]
+
+    def __init__(self, cache_dir):
+        super().__init__(cache_dir, "hierarchy.sqlite")
+
+    def get_ancestors(self, property, nodes):
+        """Look up the ancestors of nodes.
+
+        Args:
+            property: The Wikidata property forming the hierarchy (e.g.: P279).
+            nodes: A list of Wikidata entity IDs.
+
+        Returns:
+            A dictionary of node -> set of ancestors for the expanded nodes only.
+        """
+        ancestors = {}
+        step = SQLITE_MAX_VARIABLES - 1
+        with self.lock:
+            for start in range(0, len(nodes), step):
+                batch_nodes = nodes[start : start + step]
+                nodes_placeholders = ",".join(["?"] * len(batch_nodes))
+                rows = self.connection.execute(
+                    "SELECT node FROM expanded_nodes "
+                    f"WHERE property = ? AND node IN ({nodes_placeholders})",
+                    [property] + list(batch_nodes),
+                )
+                for (node,) in rows:
+                    ancestors[node] = set()
+
+                rows = self.connection.execute(
+                    "SELECT node, ancestor FROM closure "
+                    f"WHERE property = ? AND node IN ({nodes_placeholders})",
+                    [property] + list(batch_nodes),
+                )
+                for node, ancestor in rows:
+                    if node in ancestors:
+                        ancestors[node].add(ancestor)
+        return ancestors
+
+    def get_edges(self, property, nodes):
+        """Look up the stored edges from nodes to their parents.
+
+        Args:
+            property: The Wikidata property forming the hierarchy (e.g.: P279).
+            nodes: A list of Wikidata entity IDs.
+
+        Returns:
+            A list of (child, parent) tuples.
+        """
+        edges = []
+        step = SQLITE_MAX_VARIABLES - 1
+        with self.lock:
+            for start in range(0, len(nodes), step):
+                batch_nodes = nodes[start : start + step]
+                nodes_placeholders = ",".join(["?"] * len(batch_nodes))
+                rows = self.connection.execute(
+                    "SELECT child, parent FROM edges "
+                    f"WHERE property = ? AND child IN ({nodes_placeholders})",
+                    [property] + list(batch_nodes),
+                )
+                edges += [(child, parent) for child, parent in rows]
+        return edges
+
+    def add_subgraph(self, property, edges, closure):
+        """Store the edges of a subgraph that is complete for the nodes of `closure`.
+
+        Args:
+            property: The Wikidata property forming the hierarchy (e.g.: P279).
+            edges: A list of (child, parent) tuples.
+            closure: A dictionary of node -> ancestors for nodes whose ancestors are all known.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO edges (property, child, parent) VALUES (?, ?, ?)",
+                [(property, child, parent) for child, parent in edges],
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO closure (property, node, ancestor) VALUES (?, ?, ?)",
+                [
+                    (property, node, ancestor)
+                    for node in closure
+                    for ancestor in closure[node]
+                ],
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO expanded_nodes (property, node) VALUES (?, ?)",
+                [(property, node) for node in closure],
+            )
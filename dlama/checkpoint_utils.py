@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import shutil
+import logging
+import hashlib
+import threading
+import pandas as pd
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler(sys.stdout)
+formatter = logging.Formatter(
+    "%(levelname)s - %(filename)s:%(funcName)s:line %(lineno)d - %(message)s"
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+MANIFEST_PATH = str(Path("data", "manifest.json"))
+CHECKPOINTS_DIR = str(Path("data", "checkpoints"))
+
+# The stages of generating the files of a relation
+DUMP_STAGE = "dump"
+LABELS_STAGE = "labels"
+EXPORT_STAGE = "export"
+
+
+class Manifest:
+    """A json file recording the completed stages of each generated relation file."""
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def _save(self):
+        os.makedirs(self.path.parent, exist_ok=True)
+        # Write to a temporary file first so that a crash can't corrupt the manifest
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get_stages(self, key):
+        with self.lock:
+            return dict(self.entries.get(key, {}))
+
+    def set_stage(self, key, stage, value=True):
+        with self.lock:
+            self.entries.setdefault(key, {})[stage] = value
+            self._save()
+
+    def reset(self, key):
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+                self._save()
+
+
+class RelationCheckpoint:
+    """The checkpoint of the generation stages of a single relation file."""
+
+    def __init__(
+        self,
+        manifest,
+        q,
+        list_of_langs,
+        sample_size,
+        checkpoints_dir=CHECKPOINTS_DIR,
+        force=False,
+    ):
+        """
+        Args:
+            manifest: The Manifest in which the completed stages are recorded.
+            q: The query of the relation.
+            list_of_langs: The languages of the labels.
+            sample_size: The number of subjects to sample for the relation.
+            checkpoints_dir: The directory in which the intermediate outputs are stored.
+            force: Discard the previously completed stages.
+        """
+        self.manifest = manifest
+        self.name = f"{q.relation_id}_{q.domain}_{q.region_name}"
+        self.key = json.dumps(
+            {
+                "relation": q.relation_id,
+                "domain": q.domain,
+                "region": q.region_name,
+                "sorting_function": q.sorting_function,
+                "langs": list(list_of_langs),
+                "n": sample_size,
+            },
+            sort_keys=True,
+        )
+        key_hash = hashlib.sha256(self.key.encode("utf-8")).hexdigest()[:16]
+        self.checkpoint_dir = Path(checkpoints_dir, f"{self.name}_{key_hash}")
+
+        if force:
+            self.clear()
+            self.manifest.reset(self.key)
+
+    def is_done(self, stage):
+        return bool(self.manifest.get_stages(self.key).get(stage))
+
+    def mark_done(self, stage):
+        self.manifest.set_stage(self.key, stage)
+
+    def reset_export(self):
+        """Redo the labels and export stages (e.g.: if the exported files were removed)."""
+        # The intermediate outputs of the labels are removed once the files are exported
+        self.manifest.set_stage(self.key, LABELS_STAGE + "_next_batch", None)
+        self.manifest.set_stage(self.key, EXPORT_STAGE, False)
+
+    def save_labels_batch(
+        self, next_batch_start, complete_samples_df, subjects_labels, objects_labels
+    ):
+        """Store the progress of querying the labels after completing a batch."""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        complete_samples_df.to_pickle(str(Path(self.checkpoint_dir, "samples.pkl")))
+        with open(Path(self.checkpoint_dir, "labels.json"), "w") as f:
+            json.dump(
+                {"subjects": subjects_labels, "objects": objects_labels},
+                f,
+                ensure_ascii=False,
+            )
+        # The batch is only considered complete after its outputs are stored
+        self.manifest.set_stage(self.key, LABELS_STAGE + "_next_batch", next_batch_start)
+
+    def load_labels_batch(self):
+        """Load the progress of querying the labels.
+
+        Returns:
+            A tuple of the start of the next batch, the samples dataframe, the subjects' labels
+            and the objects' labels, or None if no batch was completed.
+        """
+        next_batch_start = self.manifest.get_stages(self.key).get(
+            LABELS_STAGE + "_next_batch"
+        )
+        if next_batch_start is None:
+            return None
+
+        try:
+            complete_samples_df = pd.read_pickle(
+                str(Path(self.checkpoint_dir, "samples.pkl"))
+            )
+            with open(Path(self.checkpoint_dir, "labels.json"), "r") as f:
+                labels = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load the checkpoint of '{self.name}': {e}")
+            return None
+
+        logger.info(
+            f"Resuming the labels of '{self.name}' from the subject of index {next_batch_start}"
+        )
+        return (
+            next_batch_start,
+            complete_samples_df,
+            labels["subjects"],
+            labels["objects"],
+        )
+
+    def clear(self):
+        """Remove the intermediate outputs of the relation."""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
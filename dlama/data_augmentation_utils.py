@@ -1,6 +1,7 @@
 import time
 from tqdm import tqdm
 from collections import Counter, deque
+import utils
 from utils import get_wikidata_triples, parse_sparql_results
 
 #  This is used for P19, P20 only
@@ -12,33 +13,14 @@ def find_macro_territories(places):
     place - A list of wikidata entity IDs (e.g.: [Q127238, Q79])
     """
 
-    sparql_query = (
-        """
-    SELECT DISTINCT ?micro_place ?macro_place
-    WHERE
-    {
-        {
-    """
-        f"VALUES ?micro_place {{{' '.join([f'wd:{place}' for place in places])} }} .\n"
-        f"?micro_place (wdt:P131*) ?macro_place . # located in the administrative territorial entity"
-        """
-        }
+    # located in the administrative territorial entity
+    places_ancestors = query_hierarchy_ancestors(places, "P131")
+
+    # The places are followed by their ancestors (from the nearest to the farthest one)
+    micro_to_macro_dict = {
+        place: list(dict.fromkeys([place] + places_ancestors.get(place, [])))
+        for place in places
     }
-    """
-    )
-
-    relation_triples = get_wikidata_triples(sparql_query)
-    parsed_data = parse_sparql_results(relation_triples)
-
-    #  Some parsing is needed here
-    micro_to_macro_dict = {place: [place] for place in places}
-    for tuple in parsed_data:
-        micro_place = tuple["micro_place"]
-        macro_place = tuple["macro_place"]
-        if micro_place not in micro_to_macro_dict[micro_place]:
-            micro_to_macro_dict[micro_place].append(micro_place)
-        micro_to_macro_dict[micro_place].append(macro_place)
-    time.sleep(1)
     return micro_to_macro_dict
 
 
@@ -73,13 +55,8 @@ class Graph:
         return ancestors
 
 
-def augment_objects_with_ancestors(objects_uris):
-    """Augment the objects with all their ancestors"""
-
-    # Build a graph between these entities
-    uris = list(set(objects_uris))
-
-    BATCH_SIZE = 50
+def query_ancestors_pairwise(uris, BATCH_SIZE=50):
+    """Query the sub/super relations between each pair of batches of the uris."""
     data = []
 
     # Query the sub/super relationship in batches to handle query length limits
@@ -116,9 +93,113 @@ def augment_objects_with_ancestors(objects_uris):
                     time.sleep(10)
                     remaining_retries -= 1
             time.sleep(0.1)
-    parsed_data = parse_sparql_results(data)
+    return parse_sparql_results(data)
+
+
+def query_hierarchy_ancestors(uris, property, BATCH_SIZE=50):
+    """Find all the ancestors of the uris within the hierarchy formed by a Wikidata property.
+
+    The whole upward subgraph of each batch of uris is queried at once, and its transitive
+    closure is persisted in `utils.HIERARCHY_INDEX` so that the same uris (or any of their
+    ancestors) are never queried again.
+
+    Args:
+        uris: A list of wikidata entity IDs.
+        property: The Wikidata property forming the hierarchy (e.g.: P279, P131).
+
+    Returns:
+        A dictionary of uri -> list of its ancestors (in the order of traversing the hierarchy
+        upwards from the uri).
+    """
+    uris = list(dict.fromkeys(uris))
+    index = utils.HIERARCHY_INDEX
+    stored_ancestors = index.get_ancestors(property, uris) if index else {}
+    missing_uris = [uri for uri in uris if uri not in stored_ancestors]
+
+    # Order the stored ancestors by traversing the stored edges of their subgraph
+    uris_ancestors = {}
+    if stored_ancestors:
+        nodes = set(stored_ancestors).union(*stored_ancestors.values())
+        edges = index.get_edges(property, sorted(nodes))
+        graph = Graph(nodes | {parent for _, parent in edges})
+        for child, parent in edges:
+            graph.add_edge(child, parent)
+        for uri in stored_ancestors:
+            uris_ancestors[uri] = graph.find_ancestors(uri)[1:]
+
+    for sub_batch_start in tqdm(
+        range(0, len(missing_uris), BATCH_SIZE),
+        desc=f"Query the {property} hierarchy",
+    ):
+        batch_uris = missing_uris[sub_batch_start : sub_batch_start + BATCH_SIZE]
+        sub_uris = " ".join([f"wd:{uri}" for uri in batch_uris])
+        query = f"""SELECT DISTINCT ?node ?parent
+        WHERE
+        {{
+            VALUES ?sub_uri {{{sub_uris}}} .
+            ?sub_uri wdt:{property}* ?node .
+            ?node wdt:{property} ?parent .
+        }}"""
+        remaining_retries = 3
+        while True:
+            try:
+                data = get_wikidata_triples(query)
+                break
+            except Exception as e:
+                remaining_retries -= 1
+                # Persisting a partial subgraph would corrupt the index
+                if remaining_retries == 0:
+                    raise e
+                time.sleep(10)
+
+        edges = [
+            (edge["node"], edge["parent"])
+            for edge in parse_sparql_results(data)
+            if "node" in edge and "parent" in edge
+        ]
+
+        # All the parents of every node of the upward subgraph are known
+        nodes = set(batch_uris) | {node for edge in edges for node in edge}
+        graph = Graph(nodes)
+        # The edges are sorted as the stored ones to traverse them in the same order
+        for child, parent in sorted(edges):
+            graph.add_edge(child, parent)
+        closure = {node: graph.find_ancestors(node)[1:] for node in nodes}
+
+        if index:
+            index.add_subgraph(property, edges, closure)
+        for uri in batch_uris:
+            uris_ancestors[uri] = closure[uri]
+
+    return uris_ancestors
+
+
+def augment_objects_with_ancestors(objects_uris, query_mode="linear"):
+    """Augment the objects with all their ancestors
+
+    Args:
+        objects_uris: A list of wikidata entity IDs.
+        query_mode: "linear" queries all the super classes of each batch of objects (O(n) queries)
+            and reuses the persisted hierarchy index, while "pairwise" queries the relations between each pair of batches (O(n^2) queries).
+    """
+    assert query_mode in ["linear", "pairwise"]
+
+    # Build a graph between these entities
+    uris = list(set(objects_uris))
 
-    #  Build the graph from sub/super relation edges
+    if query_mode == "linear":
+        # Intersect the super classes with the set of uris locally
+        uris_set = set(uris)
+        uris_ancestors = query_hierarchy_ancestors(uris, "P279")
+        parsed_data = [
+            {"sub_uri": uri, "super_uri": ancestor}
+            for uri in uris
+            for ancestor in sorted(set(uris_ancestors[uri]) & uris_set)
+        ]
+    else:
+        parsed_data = query_ancestors_pairwise(uris)
+
+    #  Build the graph from sub/super relation edges
     graph = Graph(objects_uris)
     for edge in parsed_data:
         graph.add_edge(edge["sub_uri"], edge["super_uri"])
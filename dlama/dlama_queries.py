@@ -3,19 +3,20 @@ from filters import *
 from query import QueryFactory
 
 
-def populate_queries(REGION, REGION_NAME, sorting_function):
+def populate_queries(REGION, REGION_NAME, sorting_function, max_workers=1):
     """Form the queries with their respective filters.
 
     Args:
         REGION: A single country/ group of countries or a list of countries.
         REGION_NAME: A string to be used for naming the results files of the queries after execution.
+        max_workers: The maximum number of countries to be queried concurrently for a list of countries.
 
     Returns:
         A list of SPAQRL query objects.
     """
     ### ALL DOMAINS ###
     DLAMA_queries = []
-    query_factory = QueryFactory()
+    query_factory = QueryFactory(max_workers=max_workers)
 
     # TODO: Reconsider whether having a domain for each query is useful.
     DOMAIN = "general"
@@ -3,6 +3,8 @@ from constants import *
 from query import QueryFactory
 from filters import *
 import utils
+import cache_utils
+import checkpoint_utils
 import data_generation_utils
 import dlama_queries
 import pandas as pd
@@ -12,6 +14,7 @@ import argparse
 import logging
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger(__name__)
 ch = logging.StreamHandler(sys.stdout)
@@ -25,15 +28,30 @@ logger.setLevel(logging.DEBUG)
 NO_RETRIES = 5
 
 
-def query_labels_for_triples(triples_df, q, LIST_OF_LANGS, SAMPLE_SIZE):
+def query_labels_for_triples(
+    triples_df, q, LIST_OF_LANGS, SAMPLE_SIZE, checkpoint=None
+):
     # Start finding all the valid objects and the labels progressively
     BATCH_SIZE = 50
+    first_batch_start = 0
     complete_samples_df = None
     all_subjects_labels = {}
     all_objects_labels = {}
     subjects_uris = triples_df[q.subject_field].unique().tolist()
 
-    for i in range(0, len(subjects_uris), BATCH_SIZE):
+    # Resume from the last completed batch
+    checkpoint_state = checkpoint.load_labels_batch() if checkpoint else None
+    if checkpoint_state:
+        (
+            first_batch_start,
+            complete_samples_df,
+            all_subjects_labels,
+            all_objects_labels,
+        ) = checkpoint_state
+        if checkpoint.is_done(checkpoint_utils.LABELS_STAGE):
+            return complete_samples_df, all_subjects_labels, all_objects_labels
+
+    for i in range(first_batch_start, len(subjects_uris), BATCH_SIZE):
         batch_start_index = triples_df[
             triples_df[q.subject_field] == subjects_uris[i]
         ].index[0]
@@ -90,9 +108,9 @@ def query_labels_for_triples(triples_df, q, LIST_OF_LANGS, SAMPLE_SIZE):
             how="left",
         )
 
-        # Query the Wikidata labels
-        subjects_ids = samples_df[q.subject_field].tolist()
-        objects_ids = samples_df[q.object_field].tolist()
+        # Query the Wikidata labels of the unique entities
+        subjects_ids = samples_df[q.subject_field].unique().tolist()
+        objects_ids = samples_df[q.object_field].unique().tolist()
         subjects_labels = utils.get_wikidata_labels(subjects_ids, LIST_OF_LANGS)
         objects_labels = utils.get_wikidata_labels(objects_ids, LIST_OF_LANGS)
 
@@ -123,12 +141,13 @@ def query_labels_for_triples(triples_df, q, LIST_OF_LANGS, SAMPLE_SIZE):
             f"Number of subjects within the batch after dropping entities with missing labels: {len(samples_df[q.subject_field].unique())}"
         )
 
-        if i == 0:
+        if complete_samples_df is None:
             complete_samples_df = samples_df
         else:
             complete_samples_df = pd.concat([complete_samples_df, samples_df])
 
         # Pick the top SAMPLE_SIZE tuples in case the queried tuples exceed the limit
+        sample_size_reached = False
         if len(set(complete_samples_df[q.subject_field].tolist())) > SAMPLE_SIZE:
             # Find the number of rows to have SAMPLE_SIZE unique subjects
             size_lower, size_upper = 1, complete_samples_df.shape[0]
@@ -146,79 +165,189 @@ def query_labels_for_triples(triples_df, q, LIST_OF_LANGS, SAMPLE_SIZE):
 
             n_subjects = (size_lower + size_upper) // 2 + (size_lower + size_upper) % 2
             complete_samples_df = complete_samples_df.head(n=n_subjects)
+            sample_size_reached = True
+
+        if checkpoint:
+            checkpoint.save_labels_batch(
+                i + BATCH_SIZE,
+                complete_samples_df,
+                all_subjects_labels,
+                all_objects_labels,
+            )
+
+        if sample_size_reached:
             break
 
+    if checkpoint:
+        checkpoint.mark_done(checkpoint_utils.LABELS_STAGE)
+
     return complete_samples_df, all_subjects_labels, all_objects_labels
 
 
-def main(
-    REGION, SAMPLE_SIZE, REGION_NAME, RELATIONS_SUBSET, LIST_OF_LANGS, sorting_function
+def generate_relation_files(
+    q, checkpoint, LIST_OF_LANGS, SAMPLE_SIZE, BASE_DATA_DIR, DATA_DUMP_DIR
 ):
-    # Create output data files
-    BASE_DATA_DIR = str(Path("data", "dlama_raw"))
-    DATA_DUMP_DIR = str(Path("data", "dlama_dump"))
-    for lang in LIST_OF_LANGS:
-        os.makedirs(Path(BASE_DATA_DIR, lang), exist_ok=True)
-    os.makedirs(DATA_DUMP_DIR, exist_ok=True)
+    """Query, label and export the triples of a single relation."""
+    start_time = time.time()
+    filename = Path(
+        DATA_DUMP_DIR, f"{q.relation_id}_{q.domain}_{q.region_name}.jsonl",
+    )
 
-    for q in dlama_queries.populate_queries(REGION, REGION_NAME, sorting_function):
-        if RELATIONS_SUBSET and q.relation_id not in RELATIONS_SUBSET:
-            continue
+    if checkpoint.is_done(checkpoint_utils.DUMP_STAGE) and filename.exists():
+        logger.info(f"Loading the dumped data from '{filename}'")
+        df = pd.read_json(filename, orient="records", lines=True, dtype=False)
+    else:
         logger.info(
             f"Querying data for '{q.relation_id}_{q.domain}_{q.region_name}.jsonl'"
         )
-        start_time = time.time()
         data = q.get_data(find_count=False, no_retries=NO_RETRIES)
 
         # Form a dataframe to make it easier to add columns
         df = pd.DataFrame(data)
 
-        #  Filter out Wikidata triples having no articles on Wikipedia
+        #  Filter out Wikidata triples having no articles on Wikipedia
         df = df[df["size"] != 0].reset_index(drop=True)
 
         # Sort the triples using the articles' sizes
         df.sort_values(by="size", ascending=False, inplace=True)
-
-        logger.info(f"Total number of subjects: {len(df[q.subject_field].unique())}")
         df.reset_index(drop=True, inplace=True)
 
         # Dump the raw data to a jsonl file
-        filename = Path(
-            DATA_DUMP_DIR, f"{q.relation_id}_{q.domain}_{q.region_name}.jsonl",
-        )
         with open(filename, "w") as f:
             for line in json.loads(df.to_json(orient="records")):
                 f.write(json.dumps(line) + "\n")
+        checkpoint.mark_done(checkpoint_utils.DUMP_STAGE)
+
+    logger.info(f"Total number of subjects: {len(df[q.subject_field].unique())}")
+
+    (
+        complete_samples_df,
+        all_subjects_labels,
+        all_objects_labels,
+    ) = query_labels_for_triples(
+        df, q, LIST_OF_LANGS, SAMPLE_SIZE, checkpoint=checkpoint
+    )
+    logger.info(
+        f"Final number of subjects: {len(complete_samples_df[q.subject_field].unique())}"
+    )
+
+    # Export the triples to jsonl files
+    for lang in LIST_OF_LANGS:
+        filename = Path(
+            BASE_DATA_DIR,
+            lang,
+            f"{q.relation_id}_{q.domain}_{q.region_name}.jsonl",
+        )
+        complete_samples_df["sub_label"] = complete_samples_df[q.subject_field].apply(
+            lambda uri: all_subjects_labels[uri][lang]
+        )
+        complete_samples_df["obj_label"] = complete_samples_df[q.object_field].apply(
+            lambda uri: all_objects_labels[uri][lang]
+        )
+
+        data_generation_utils.generate_facts_jsonl(complete_samples_df, q, filename)
 
-        (
-            complete_samples_df,
-            all_subjects_labels,
-            all_objects_labels,
-        ) = query_labels_for_triples(df, q, LIST_OF_LANGS, SAMPLE_SIZE)
         logger.info(
-            f"Final number of subjects: {len(complete_samples_df[q.subject_field].unique())}"
+            f"Successfully generated '{q.relation_id}_{q.domain}_{q.region_name}.jsonl'"
         )
+    checkpoint.mark_done(checkpoint_utils.EXPORT_STAGE)
+    checkpoint.clear()
+    logger.info(f"Time elapsed is: {time.time() - start_time} seconds")
 
-        # Export the triples to jsonl files
-        for lang in LIST_OF_LANGS:
-            filename = Path(
-                BASE_DATA_DIR,
-                lang,
-                f"{q.relation_id}_{q.domain}_{q.region_name}.jsonl",
-            )
-            complete_samples_df["sub_label"] = complete_samples_df[
-                q.subject_field
-            ].apply(lambda uri: all_subjects_labels[uri][lang])
-            complete_samples_df["obj_label"] = complete_samples_df[
-                q.object_field
-            ].apply(lambda uri: all_objects_labels[uri][lang])
 
-            data_generation_utils.generate_facts_jsonl(complete_samples_df, q, filename)
+def main(
+    REGION,
+    SAMPLE_SIZE,
+    REGION_NAME,
+    RELATIONS_SUBSET,
+    LIST_OF_LANGS,
+    sorting_function,
+    cache_dir=None,
+    refresh=False,
+    query_workers=1,
+    force=False,
+    workers=1,
+):
+    utils.init_cache(cache_dir, refresh=refresh)
+    manifest = checkpoint_utils.Manifest()
+
+    # Create output data files
+    BASE_DATA_DIR = str(Path("data", "dlama_raw"))
+    DATA_DUMP_DIR = str(Path("data", "dlama_dump"))
+    for lang in LIST_OF_LANGS:
+        os.makedirs(Path(BASE_DATA_DIR, lang), exist_ok=True)
+    os.makedirs(DATA_DUMP_DIR, exist_ok=True)
+
+    relations_queries = []
+    for q in dlama_queries.populate_queries(
+        REGION, REGION_NAME, sorting_function, max_workers=query_workers
+    ):
+        if RELATIONS_SUBSET and q.relation_id not in RELATIONS_SUBSET:
+            continue
+        checkpoint = checkpoint_utils.RelationCheckpoint(
+            manifest, q, LIST_OF_LANGS, SAMPLE_SIZE, force=force
+        )
+        if checkpoint.is_done(checkpoint_utils.EXPORT_STAGE):
+            # The exported files might have been removed since they were generated
+            exported_files_exist = all(
+                [
+                    Path(
+                        BASE_DATA_DIR,
+                        lang,
+                        f"{q.relation_id}_{q.domain}_{q.region_name}.jsonl",
+                    ).exists()
+                    for lang in LIST_OF_LANGS
+                ]
+            )
+            if exported_files_exist:
+                logger.info(
+                    f"Skipping '{q.relation_id}_{q.domain}_{q.region_name}.jsonl' as it was already generated"
+                )
+                continue
 
             logger.info(
-                f"Successfully generated '{q.relation_id}_{q.domain}_{q.region_name}.jsonl'"
+                f"Regenerating '{q.relation_id}_{q.domain}_{q.region_name}.jsonl' as its files are missing"
             )
-        logger.info(f"Time elapsed is: {time.time() - start_time} seconds")
+            checkpoint.reset_export()
+
+        relations_queries.append((q, checkpoint))
+
+    if workers <= 1:
+        for q, checkpoint in relations_queries:
+            generate_relation_files(
+                q, checkpoint, LIST_OF_LANGS, SAMPLE_SIZE, BASE_DATA_DIR, DATA_DUMP_DIR
+            )
+        return
+
+    # Overlap the stages of different relations (e.g.: one relation querying labels while
+    # another one waits for the SPARQL endpoint), while the shared HTTP client rate-limits
+    # the requests of all the relations
+    failed_relations = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                generate_relation_files,
+                q,
+                checkpoint,
+                LIST_OF_LANGS,
+                SAMPLE_SIZE,
+                BASE_DATA_DIR,
+                DATA_DUMP_DIR,
+            ): q
+            for q, checkpoint in relations_queries
+        }
+        for future in as_completed(futures):
+            q = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(
+                    f"Failed to generate '{q.relation_id}_{q.domain}_{q.region_name}.jsonl': {e}"
+                )
+                failed_relations.append(q.relation_id)
+
+    if failed_relations:
+        raise RuntimeError(f"Failed to generate the relations: {failed_relations}")
 
 
 if __name__ == "__main__":
@@ -270,6 +399,34 @@ if __name__ == "__main__":
         choices=["size", "edits"],
         help="The metric used to sort the queried triples before sampling",
     )
+    parser.add_argument(
+        "--query_workers",
+        type=int,
+        default=1,
+        help="The maximum number of countries of a region to be queried concurrently",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of relations to be generated concurrently",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Regenerate the relations' files even if the manifest marks them as completed",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        "--cache-dir",
+        default=cache_utils.DEFAULT_CACHE_DIR,
+        help="Directory for caching the results of the SPARQL queries and the labels (an empty string disables caching)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-execute the SPARQL queries instead of using their cached results",
+    )
     args = parser.parse_args()
 
     main(
@@ -279,4 +436,9 @@ if __name__ == "__main__":
         RELATIONS_SUBSET=args.rel,
         LIST_OF_LANGS=args.langs,
         sorting_function=args.sorting_function,
+        cache_dir=args.cache_dir,
+        refresh=args.refresh,
+        query_workers=args.query_workers,
+        force=args.force,
+        workers=args.workers,
     )
@@ -7,6 +7,7 @@ import pandas as pd
 from tqdm import tqdm
 from pathlib import Path
 import utils
+import cache_utils
 import data_augmentation_utils
 import argparse
 
@@ -23,108 +24,120 @@ logger.addHandler(ch)
 logger.setLevel(logging.DEBUG)
 
 
-def generate_exhaustive_objects_lists(LIST_OF_RELATIONS, LIST_OF_LANGUAGES):
+def generate_exhaustive_objects_lists(
+    LIST_OF_RELATIONS, LIST_OF_LANGUAGES, ancestors_query_mode="linear"
+):
     BASE_DATA_DIR = str(Path("data", "dlama_raw"))
     OUTPUT_DATA_DIR = str(Path("data", "dlama"))
     for lang in LIST_OF_LANGUAGES:
         os.makedirs(Path(OUTPUT_DATA_DIR, lang), exist_ok=True)
 
-    # TODO: Don't repeat the same query multiple times for each language!
+    # The hierarchy of the objects doesn't depend on the language of the labels
+    relations_files = {}
     for lang in LIST_OF_LANGUAGES:
-        files = glob.glob(str(Path(BASE_DATA_DIR, lang, "*")))
-        relations = [re.findall(r"P[0-9]+", file)[0] for file in files]
-        relations = [r for r in relations if r in LIST_OF_RELATIONS]
-
-        for relation in tqdm(
-            sorted(set(relations)), desc=f"Generate relation's '{lang}' files"
-        ):
-            relation_files = glob.glob(str(Path(BASE_DATA_DIR, lang, f"{relation}_*")))
-            relation_triples = []
+        for file in glob.glob(str(Path(BASE_DATA_DIR, lang, "*"))):
+            relation = re.findall(r"P[0-9]+", file)[0]
+            if relation in LIST_OF_RELATIONS:
+                relations_files.setdefault(relation, {}).setdefault(lang, []).append(
+                    file
+                )
+
+    for relation in tqdm(sorted(relations_files), desc="Generate relations' files"):
+        langs_relation_files = relations_files[relation]
+
+        # Collect the objects of the relation for all the languages
+        objects_uris = []
+        langs_uris_to_labels = {}
+        for lang, relation_files in langs_relation_files.items():
+            langs_uris_to_labels[lang] = {}
             for relation_file in relation_files:
                 with open(relation_file, "r") as f:
-                    relation_triples += [json.loads(l) for l in f]
-
-            samples_df = pd.DataFrame(relation_triples)
-            objects_uris = [o for o_l in samples_df["obj_uri"].tolist() for o in o_l]
-            objects_labels = [
-                o for o_l in samples_df["obj_label"].tolist() for o in o_l
+                    for l in f:
+                        triple = json.loads(l)
+                        objects_uris += triple["obj_uri"]
+                        langs_uris_to_labels[lang].update(
+                            zip(triple["obj_uri"], triple["obj_label"])
+                        )
+        objects_uris = list(dict.fromkeys(objects_uris))
+
+        if relation in ["P19", "P20"]:
+            NO_OF_RETRIES = 10
+            while NO_OF_RETRIES:
+                try:
+                    # Find all intermediate cities as well that aren't countries
+                    objects_ancestors_dict = data_augmentation_utils.find_macro_territories(
+                        sorted(objects_uris)
+                    )
+                    break
+                except Exception as e:
+                    logger.debug(f"Rate limited on finding the macro territories")
+                    time.sleep(10)
+                    NO_OF_RETRIES -= 1
+                    if not NO_OF_RETRIES:
+                        raise (e)
+
+            ancestors_uris = [
+                uri
+                for k in objects_ancestors_dict
+                for uri in objects_ancestors_dict[k]
             ]
 
-            if relation in ["P19", "P20"]:
-                NO_OF_RETRIES = 10
-                while NO_OF_RETRIES:
-                    try:
-                        # Find all intermediate cities as well that aren't countries
-                        step = 50
-                        unique_object_uris = sorted(set(objects_uris))
-                        objects_ancestors_dicts = [
-                            data_augmentation_utils.find_macro_territories(
-                                unique_object_uris[i : i + step]
-                            )
-                            for i in tqdm(range(0, len(unique_object_uris), step))
+            NO_OF_RETRIES = 10
+            while NO_OF_RETRIES:
+                try:
+                    objects_labels = utils.get_wikidata_labels(
+                        ancestors_uris, LIST_OF_LANGUAGES
+                    )
+                    break
+                except Exception as e:
+                    logger.debug(f"Rate limited on getting the labels")
+                    time.sleep(10)
+                    NO_OF_RETRIES -= 1
+                    if not NO_OF_RETRIES:
+                        raise (e)
+
+            #  Some of the labels will be missing for one of more languages!
+            langs_uris_to_labels = {
+                lang: {
+                    uri: objects_labels[uri][lang]
+                    for uri in ancestors_uris
+                    if all(
+                        [
+                            objects_labels.get(uri, {}).get(l, None)
+                            for l in LIST_OF_LANGUAGES
                         ]
-                        break
-                    except:
-                        logger.debug(f"Rate limited on finding the macro territories")
-                        time.sleep(10)
-                        NO_OF_RETRIES -= 1
-                        if not NO_OF_RETRIES:
-                            raise (e)
-
-                objects_ancestors_dict = {
-                    obj_uri: d[obj_uri]
-                    for d in objects_ancestors_dicts
-                    for obj_uri in d
+                    )
                 }
-                objects_uris = [
-                    uri
-                    for k in objects_ancestors_dict
-                    for uri in objects_ancestors_dict[k]
+                for lang in langs_relation_files
+            }
+
+            objects_ancestors_dict = {
+                obj_uri: [
+                    ancestor
+                    for ancestor in objects_ancestors_dict[obj_uri]
+                    if all(
+                        [
+                            ancestor in langs_uris_to_labels[lang]
+                            for lang in langs_relation_files
+                        ]
+                    )
                 ]
-
-                NO_OF_RETRIES = 10
-                while NO_OF_RETRIES:
-                    try:
-                        objects_labels = utils.get_wikidata_labels(
-                            objects_uris, LIST_OF_LANGUAGES
-                        )
-
-                        #  Some of the labels will be missing for one of more languages!
-                        uris_to_labels = {
-                            uri: objects_labels[uri][lang]
-                            for uri in objects_uris
-                            if all(
-                                [
-                                    objects_labels.get(uri, {}).get(l, None)
-                                    for l in LIST_OF_LANGUAGES
-                                ]
-                            )
-                        }
-
-                        objects_ancestors_dict = {
-                            obj_uri: [
-                                ancestor
-                                for ancestor in objects_ancestors_dict[obj_uri]
-                                if ancestor in uris_to_labels
-                            ]
-                            for obj_uri in objects_ancestors_dict
-                        }
-                        break
-                    except Exception as e:
-                        logger.debug(f"Rate limited on getting the labels")
-                        time.sleep(10)
-                        NO_OF_RETRIES -= 1
-                        if not NO_OF_RETRIES:
-                            raise (e)
-            else:
-                objects_ancestors_dict = data_augmentation_utils.augment_objects_with_ancestors(
-                    objects_uris
-                )
-
-                uris_to_labels = {
-                    uri: label for uri, label in zip(objects_uris, objects_labels)
-                }
-
+                for obj_uri in objects_ancestors_dict
+            }
+        else:
+            objects_ancestors_dict = data_augmentation_utils.augment_objects_with_ancestors(
+                objects_uris, query_mode=ancestors_query_mode
+            )
+
+        # Write the files of all the languages
+        for lang, relation_files in langs_relation_files.items():
+            uris_to_labels = langs_uris_to_labels[lang]
+            # The hierarchy is transitive, so keeping the ancestors that are labelled for the
+            # language is the same as only augmenting the objects of the language's files
+            lang_objects_ancestors_dict = {
+                uri: [ancestor for ancestor in ancestors if ancestor in uris_to_labels]
+                for uri, ancestors in objects_ancestors_dict.items()
+            }
             for relation_file in relation_files:
                 with open(relation_file, "r") as f:
                     with open(
@@ -136,7 +149,7 @@ def generate_exhaustive_objects_lists(LIST_OF_RELATIONS, LIST_OF_LANGUAGES):
                                 set(
                                     sum(
                                         [
-                                            objects_ancestors_dict[uri]
+                                            lang_objects_ancestors_dict[uri]
                                             for uri in triple["obj_uri"]
                                         ],
                                         [],
@@ -153,8 +166,17 @@ def generate_exhaustive_objects_lists(LIST_OF_RELATIONS, LIST_OF_LANGUAGES):
                             of.write("\n")
 
 
-def main(LIST_OF_RELATIONS, LIST_OF_LANGUAGES):
-    generate_exhaustive_objects_lists(LIST_OF_RELATIONS, LIST_OF_LANGUAGES)
+def main(
+    LIST_OF_RELATIONS,
+    LIST_OF_LANGUAGES,
+    cache_dir=None,
+    refresh=False,
+    ancestors_query_mode="linear",
+):
+    utils.init_cache(cache_dir, refresh=refresh)
+    generate_exhaustive_objects_lists(
+        LIST_OF_RELATIONS, LIST_OF_LANGUAGES, ancestors_query_mode=ancestors_query_mode
+    )
 
 
 if __name__ == "__main__":
@@ -172,5 +194,28 @@ if __name__ == "__main__":
         required=True,
         help="A white-space separated list of Wikipedia languages (e.g.: 'en ko')",
     )
+    parser.add_argument(
+        "--ancestors_query_mode",
+        default="linear",
+        choices=["linear", "pairwise"],
+        help="Query all the super classes of each batch of objects (linear) or the relations between each pair of batches (pairwise)",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        "--cache-dir",
+        default=cache_utils.DEFAULT_CACHE_DIR,
+        help="Directory for caching the results of the SPARQL queries and the labels (an empty string disables caching)",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-execute the SPARQL queries instead of using their cached results",
+    )
     args = parser.parse_args()
-    main(args.rel, args.langs)
+    main(
+        args.rel,
+        args.langs,
+        cache_dir=args.cache_dir,
+        refresh=args.refresh,
+        ancestors_query_mode=args.ancestors_query_mode,
+    )
@@ -0,0 +1,173 @@
+import sys
+import time
+import logging
+import threading
+import requests
+from tqdm import tqdm
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+ch = logging.StreamHandler(sys.stdout)
+formatter = logging.Formatter(
+    "%(levelname)s - %(filename)s:%(funcName)s:line %(lineno)d - %(message)s"
+)
+ch.setFormatter(formatter)
+logger.addHandler(ch)
+logger.setLevel(logging.DEBUG)
+
+# https://meta.wikimedia.org/wiki/User-Agent_policy
+USER_AGENT = "DLAMA (https://github.com/AMR-KELEG/DLAMA)"
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_REQUESTS_PER_SECOND = 10
+# The SPARQL endpoint is much more expensive than the MediaWiki APIs
+HOSTS_REQUESTS_PER_SECOND = {"query.wikidata.org": 1}
+RATE_LIMITED_STATUS_CODES = [429, 503]
+
+
+class TokenBucket:
+    """A thread-safe token bucket limiting the rate of requests sent to a host."""
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate: The number of tokens added to the bucket per second.
+            capacity: The maximum number of tokens (i.e.: burst size) of the bucket.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity else max(1, rate)
+        self.tokens = self.capacity
+        self.last_update = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Stop handing out tokens for a number of seconds (e.g.: Retry-After)."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(
+                        self.capacity,
+                        self.tokens
+                        + (now - max(self.last_update, self.paused_until)) * self.rate,
+                    )
+                    self.last_update = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    delay = self.paused_until - now
+            time.sleep(delay)
+
+
+class HttpClient:
+    """A rate-limited HTTP client sharing a pool of keep-alive connections."""
+
+    def __init__(
+        self,
+        max_workers=DEFAULT_MAX_WORKERS,
+        requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+        max_retries=5,
+    ):
+        """
+        Args:
+            max_workers: The maximum number of requests in flight.
+            requests_per_second: The default rate limit for each host.
+            max_retries: The number of times a rate-limited request is retried.
+        """
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": USER_AGENT})
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        # Bound the number of requests in flight across all the threads
+        self.in_flight = threading.BoundedSemaphore(max_workers)
+
+    def _get_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(
+                    HOSTS_REQUESTS_PER_SECOND.get(host, self.requests_per_second)
+                )
+            return self.buckets[host]
+
+    @staticmethod
+    def _get_retry_after(response, default_delay):
+        try:
+            return float(response.headers["Retry-After"])
+        except (KeyError, ValueError):
+            # Retry-After might be missing or an HTTP date
+            return default_delay
+
+    def request(self, method, url, **kwargs):
+        """Send a request once the host's rate limit allows it.
+
+        Rate-limited responses (429/503) are retried after the delay specified by
+        their Retry-After header (or an exponential backoff if it is missing).
+        """
+        bucket = self._get_bucket(url)
+        graceful_delay = 1
+        for _ in range(self.max_retries):
+            bucket.acquire()
+            with self.in_flight:
+                response = self.session.request(method, url, **kwargs)
+            if response.status_code not in RATE_LIMITED_STATUS_CODES:
+                return response
+
+            delay = self._get_retry_after(response, graceful_delay)
+            logger.debug(f"Rate limited by '{urlparse(url).netloc}' for {delay}s.")
+            bucket.pause(delay)
+            graceful_delay *= 2
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def map(self, function, items, desc=None):
+        """Apply a function (that sends requests) to items concurrently.
+
+        Args:
+            function: A function of a single argument.
+            items: A list of the function's arguments.
+            desc: A description for the progress bar.
+
+        Returns:
+            A list of the function's outputs in the same order of the items.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(
+                tqdm(executor.map(function, items), total=len(items), desc=desc)
+            )
+
+
+CLIENT = HttpClient()
+
+
+def init_client(
+    max_workers=DEFAULT_MAX_WORKERS, requests_per_second=DEFAULT_REQUESTS_PER_SECOND
+):
+    """Replace the shared HTTP client with one of different limits."""
+    global CLIENT
+    CLIENT = HttpClient(
+        max_workers=max_workers, requests_per_second=requests_per_second
+    )
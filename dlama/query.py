@@ -4,7 +4,7 @@ import utils
 import logging
 import sys
 import time
-from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 logger = logging.getLogger(__name__)
 ch = logging.StreamHandler(sys.stdout)
@@ -210,12 +210,9 @@ class Query:
                             urls, lang=lang
                         )
                     else:
-                        wikipedia_sizes_dict = {
-                            url: utils.get_wikipedia_article_edits(
-                                url, wikipedia_lang=lang
-                            )
-                            for url in tqdm(urls)
-                        }
+                        wikipedia_sizes_dict = utils.get_wikipedia_articles_edits(
+                            urls, lang=lang
+                        )
 
                     # Add the size column to the dataframe
                     for triple in parsed_data:
@@ -250,6 +247,7 @@ class GroupedQuery:
         region,
         region_name,
         sorting_function,
+        max_workers=1,
     ):
         self.relation_id = relation_id
         self.subject_field = subject_field
@@ -258,6 +256,8 @@ class GroupedQuery:
         self.region = region
         self.region_name = region_name
         self.sorting_function = sorting_function
+        # The maximum number of subqueries to be executed concurrently
+        self.max_workers = max_workers
         self.lazy_filters = (
             []
         )  # Lazy filters are filters that are used only on forming each subquery
@@ -307,20 +307,40 @@ class GroupedQuery:
             self.subqueries.append(subquery)
 
     def get_data(self, find_count=False, limit=None, no_retries=10):
-        """Execute the SPARQL subqueries in series.
+        """Execute the SPARQL subqueries concurrently using up to `max_workers` threads.
 
         Args:
             find_count: Only return the count of the entries fulfilling the conditions.
             limit: The number of entries to return.
-            no_retries: The number of times to retry executing the query before giving up.
+            no_retries: The number of times to retry executing each subquery before giving up.
 
         Returns:
             A list of dictionaries representing the results for the whole region.
         """
         self.form_subqueries()
-        data = []
-        for subquery in self.subqueries:
+
+        def get_subquery_data(subquery):
+            start_time = time.time()
             subquery_data = subquery.get_data(find_count, limit, no_retries)
+            logger.info(
+                f"Subquery of '{subquery.region}' for '{self.relation_id}' returned "
+                f"{len(subquery_data)} entries in {time.time() - start_time:.1f} seconds"
+            )
+            return subquery_data
+
+        # Each subquery is retried independently of the others
+        subqueries_data = [None for _ in self.subqueries]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {
+                executor.submit(get_subquery_data, subquery): i
+                for i, subquery in enumerate(self.subqueries)
+            }
+            for future in as_completed(futures):
+                subqueries_data[futures[future]] = future.result()
+
+        # Merge the results in the order of the countries within the region
+        data = []
+        for subquery_data in subqueries_data:
             data += subquery_data
         return data
 
@@ -328,6 +348,13 @@ class GroupedQuery:
 class QueryFactory:
     """A class for forming queries based on the type of the region used."""
 
+    def __init__(self, max_workers=1):
+        """
+        Args:
+            max_workers: The maximum number of subqueries of a GroupedQuery to be executed concurrently.
+        """
+        self.max_workers = max_workers
+
     def create_query(
         self,
         relation_id,
@@ -348,6 +375,7 @@ class QueryFactory:
                 region,
                 region_name,
                 sorting_function,
+                max_workers=self.max_workers,
             )
         #  The region is a single country/ a single group of countries (e.g.: Arab region)
         else:
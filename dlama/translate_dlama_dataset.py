@@ -3,7 +3,8 @@ import copy
 import glob
 import json
 from tqdm import tqdm
-from utils import get_wikidata_labels
+from utils import get_wikidata_labels, init_cache
+from cache_utils import DEFAULT_CACHE_DIR
 from os import makedirs
 from pathlib import Path
 from argparse import ArgumentParser
@@ -15,8 +16,9 @@ def load_file(filename):
     return data
 
 
-def main(BASE_DIR, other_lang):
+def main(BASE_DIR, other_lang, cache_dir=None):
     """Translate data files of DLAMA into a new language"""
+    init_cache(cache_dir)
     makedirs(str(Path(BASE_DIR, other_lang)), exist_ok=True)
     files = sorted([f for f in glob.glob(str(Path(BASE_DIR, "en", "*")))])
 
@@ -69,6 +71,12 @@ if __name__ == "__main__":
     args_parser.add_argument(
         "--dir", required=True, help="Base directory of the dataset"
     )
+    args_parser.add_argument(
+        "--cache_dir",
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="Directory for caching the queried labels (an empty string disables caching)",
+    )
     args = args_parser.parse_args()
 
-    main(BASE_DIR=args.dir, other_lang=args.lang)
+    main(BASE_DIR=args.dir, other_lang=args.lang, cache_dir=args.cache_dir)
@@ -1,10 +1,11 @@
 import re
 import time
 import requests
-from tqdm import tqdm
 import logging
 import sys
+import http_utils
 from pathlib import Path
+from cache_utils import SparqlCache, LabelsStore, ArticlesEditsStore, HierarchyIndex
 
 logger = logging.getLogger(__name__)
 ch = logging.StreamHandler(sys.stdout)
@@ -15,6 +16,27 @@ ch.setFormatter(formatter)
 logger.addHandler(ch)
 logger.setLevel(logging.DEBUG)
 
+# The on-disk caches of SPARQL results, labels, articles' number of edits and
+# hierarchies of entities (disabled until `init_cache` is called)
+SPARQL_CACHE = None
+LABELS_STORE = None
+EDITS_STORE = None
+HIERARCHY_INDEX = None
+
+
+def init_cache(cache_dir, refresh=False):
+    """Cache the results of the SPARQL queries, the labels, the articles' edits and the hierarchies within `cache_dir`.
+
+    Args:
+        cache_dir: The directory of the cache (None to disable caching).
+        refresh: Re-execute the queries and overwrite their cached results.
+    """
+    global SPARQL_CACHE, LABELS_STORE, EDITS_STORE, HIERARCHY_INDEX
+    SPARQL_CACHE = SparqlCache(cache_dir, refresh=refresh) if cache_dir else None
+    LABELS_STORE = LabelsStore(cache_dir) if cache_dir else None
+    EDITS_STORE = ArticlesEditsStore(cache_dir, refresh=refresh) if cache_dir else None
+    HIERARCHY_INDEX = HierarchyIndex(cache_dir) if cache_dir else None
+
 
 def graceful_get_wikidata_triples(query, max_retries=5):
     graceful_delay = 1
@@ -29,11 +51,20 @@ def graceful_get_wikidata_triples(query, max_retries=5):
 
 
 def get_wikidata_triples(query):
-    """Query wikidata using a SPARQL query"""
+    """Query wikidata using a SPARQL query (or load its cached results)"""
+    if SPARQL_CACHE is not None:
+        cached_results = SPARQL_CACHE.get(query)
+        if cached_results is not None:
+            return cached_results
+
     url = "https://query.wikidata.org/sparql"
-    r = requests.post(url, params={"format": "json"}, data={"query": query})
+    r = http_utils.CLIENT.post(url, params={"format": "json"}, data={"query": query})
     data = r.json()
-    return data["results"]["bindings"]
+    results = data["results"]["bindings"]
+
+    if SPARQL_CACHE is not None:
+        SPARQL_CACHE.set(query, results)
+    return results
 
 
 def parse_sparql_results(results_list):
@@ -59,35 +90,77 @@ def get_wikidata_labels(wikidata_entities_ids, list_of_languages):
     MAX_BATCH_SIZE = (
         50  # https://www.wikidata.org/wiki/Wikidata:Data_access#MediaWiki_Action_API
     )
-    labels = {}
-    langs = "|".join(list_of_languages)
-    for start in tqdm(
-        range(0, len(wikidata_entities_ids), MAX_BATCH_SIZE),
-        desc="Query labels of Wikidata entities",
-    ):
-        ids = wikidata_entities_ids[start : start + MAX_BATCH_SIZE]
-        wikidata_ids = "|".join([id for id in ids if not id.startswith("http")])
+    # Remove the duplicate ids while preserving their order
+    unique_ids = list(dict.fromkeys(wikidata_entities_ids))
+
+    # Skipped entities
+    labels = {
+        entity: {lang: None for lang in list_of_languages}
+        for entity in unique_ids
+        if entity.startswith("http")
+    }
+    entities_ids = [id for id in unique_ids if not id.startswith("http")]
+
+    stored_labels = (
+        LABELS_STORE.get_labels(entities_ids, list_of_languages)
+        if LABELS_STORE is not None
+        else {}
+    )
+
+    # Only query the (entity, language) pairs that aren't stored yet
+    missing_langs_to_ids = {}
+    for entity in entities_ids:
+        entity_labels = stored_labels.get(entity, {})
+        missing_langs = tuple(
+            [lang for lang in list_of_languages if lang not in entity_labels]
+        )
+        if missing_langs:
+            missing_langs_to_ids.setdefault(missing_langs, []).append(entity)
+        else:
+            labels[entity] = {lang: entity_labels[lang] for lang in list_of_languages}
+
+    def query_labels(batch):
+        missing_langs, ids = batch
         url = (
             "https://www.wikidata.org/w/api.php?"
             "action=wbgetentities"
-            f"&ids={wikidata_ids}"
-            f"&languages={langs}&format=json&props=labels"
+            f"&ids={'|'.join(ids)}"
+            f"&languages={'|'.join(missing_langs)}&format=json&props=labels"
         )
 
         additional_headers = {"content-encoding": "gzip"}
-        r = requests.get(url, headers=additional_headers)
+        r = http_utils.CLIENT.get(url, headers=additional_headers)
         data = r.json()["entities"]
-        time.sleep(0.1)
 
-        for entity in data:
-            labels[entity] = {
+        return {
+            entity: {
                 lang: data[entity].get("labels", {}).get(lang, {}).get("value", None)
-                for lang in list_of_languages
+                for lang in missing_langs
             }
+            for entity in data
+        }
 
-        # Skipped entities
-        for entity in [id for id in ids if id.startswith("http")]:
-            labels[entity] = {lang: None for lang in list_of_languages}
+    batches = [
+        (missing_langs, ids_to_query[start : start + MAX_BATCH_SIZE])
+        for missing_langs, ids_to_query in missing_langs_to_ids.items()
+        for start in range(0, len(ids_to_query), MAX_BATCH_SIZE)
+    ]
+    batches_labels = http_utils.CLIENT.map(
+        query_labels, batches, desc="Query labels of Wikidata entities"
+    )
+
+    for queried_labels in batches_labels:
+        if LABELS_STORE is not None:
+            LABELS_STORE.set_labels(queried_labels)
+
+        for entity in queried_labels:
+            entity_labels = {
+                **stored_labels.get(entity, {}),
+                **queried_labels[entity],
+            }
+            labels[entity] = {
+                lang: entity_labels.get(lang, None) for lang in list_of_languages
+            }
     return labels
 
 
@@ -98,7 +171,7 @@ def get_article_sizes(articles_titles, lang):
         f"{titles_to_query}&prop=revisions&rvprop=size&redirects"
     )
     additional_headers = {"content-encoding": "gzip"}
-    response = requests.get(url, headers=additional_headers).json()
+    response = http_utils.CLIENT.get(url, headers=additional_headers).json()
 
     pages_responses = response["query"]["pages"]
     redirects = (
@@ -108,7 +181,6 @@ def get_article_sizes(articles_titles, lang):
     redirected_titles_to_original_titles = {
         redirect["to"]: redirect["from"] for redirect in redirects
     }
-    time.sleep(0.1)
 
     return pages_responses, redirected_titles_to_original_titles
 
@@ -117,13 +189,10 @@ def get_wikipedia_article_sizes(articles_urls, lang):
     """Get the size of wikipedia articles in bytes"""
 
     MAX_BATCH_SIZE = 50  # https://www.mediawiki.org/wiki/API:Query#Additional_notes
-    # A dictionary of url -> article size
-    articles_sizes = {}
-    for start in tqdm(
-        range(0, len(articles_urls), MAX_BATCH_SIZE),
-        desc=f"Query sizes of Wikipedia articles in '{lang}'",
-    ):
-        cur_batch_articles_urls = articles_urls[start : start + MAX_BATCH_SIZE]
+
+    def query_batch_sizes(cur_batch_articles_urls):
+        # A dictionary of url -> article size
+        articles_sizes = {}
         HTML_encoded_titles = [url.split("/")[-1] for url in cur_batch_articles_urls]
 
         # Get the articles' normalized titles from the urls
@@ -197,10 +266,28 @@ def get_wikipedia_article_sizes(articles_urls, lang):
                 )
                 logger.warning(pages_responses[page_id],)
 
-    return articles_sizes
+        return articles_sizes
 
+    batches = [
+        articles_urls[start : start + MAX_BATCH_SIZE]
+        for start in range(0, len(articles_urls), MAX_BATCH_SIZE)
+    ]
+    batches_sizes = http_utils.CLIENT.map(
+        query_batch_sizes,
+        batches,
+        desc=f"Query sizes of Wikipedia articles in '{lang}'",
+    )
 
-def get_wikipedia_article_edits(article_url, wikipedia_lang):
+    # A dictionary of url -> article size
+    return {
+        url: size
+        for batch_sizes in batches_sizes
+        for url, size in batch_sizes.items()
+    }
+
+
+def query_wikipedia_article_edits(article_url, wikipedia_lang):
+    """Query the number of edits of a wikipedia article (None if it can't be retrieved)"""
     page_name = Path(article_url).name
     url = (
         f"https://{wikipedia_lang}.wikipedia.org/w/rest.php/v1/page/"
@@ -208,12 +295,41 @@ def get_wikipedia_article_edits(article_url, wikipedia_lang):
         + "/history/counts/edits"
     )
 
-    response = requests.get(url)
-    data = response.json()
-
+    # A failed request or a non-JSON response only affects this article
     try:
-        return data["count"]
-    except:
-        return 0
+        response = http_utils.CLIENT.get(url)
+        data = response.json()
+    except Exception as e:
+        logger.debug(e)
+        logger.info(f"Couldn't retrieve the number of edits of '{article_url}'.")
+        return None
+
+    return data.get("count", None) if isinstance(data, dict) else None
 
 
+def get_wikipedia_articles_edits(articles_urls, lang):
+    """Get the number of edits of wikipedia articles (0 for the ones that can't be retrieved)"""
+    # The edits endpoint has no multi-page variant so the articles are queried concurrently
+    unique_urls = list(dict.fromkeys(articles_urls))
+
+    articles_edits = (
+        EDITS_STORE.get_edits(unique_urls, lang) if EDITS_STORE is not None else {}
+    )
+    urls_to_query = [url for url in unique_urls if url not in articles_edits]
+
+    def query_edits(url):
+        edits = query_wikipedia_article_edits(url, lang)
+        # Only store the counts that were retrieved successfully
+        if edits is not None and EDITS_STORE is not None:
+            EDITS_STORE.set_edits({url: edits}, lang)
+        return edits
+
+    queried_edits = http_utils.CLIENT.map(
+        query_edits,
+        urls_to_query,
+        desc=f"Query edits of Wikipedia articles in '{lang}'",
+    )
+    for url, edits in zip(urls_to_query, queried_edits):
+        articles_edits[url] = edits if edits is not None else 0
+
+    return articles_edits
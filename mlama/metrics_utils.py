@@ -1,11 +1,19 @@
+import os
 import glob
-import re
 import pickle
+import itertools
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from natsort import natsorted
 from dataset_analysis_utils import normalize_region_name
+from scripts.results_utils import (
+    read_columns,
+    unflatten,
+    decode_predictions,
+    get_results_file_path,
+)
 
 #  TODO: Load this list from the constants.py file within dlama
 DOMAINS = [
@@ -19,68 +27,78 @@ DOMAINS = [
 ]
 
 
-def load_predicate_results(results_dir, relation_id, model_name, lang):
+def parse_uuids(uuids):
+    """Infer the region, the domain and the id of samples from their uuids.
+
+    Returns:
+        A dataframe of the "region", "domain" and "id" of the samples.
     """
-    Return a dataframe of a model's predictions for a specific relation in a specific language.
+    # Remove the "_REGION" from the samples' names
+    samples_ids = pd.Series(uuids, dtype=object).str.replace("_REGION", "", regex=False)
+    fields = samples_ids.str.split("_")
+
+    # Infer the domain from the sample ID (i.e.: the first domain within the ID)
+    domain = np.select(
+        [samples_ids.str.contains(d, regex=False).values for d in DOMAINS],
+        DOMAINS,
+        default="general",
+    )
+
+    regions_names = fields.str[-2]
+    region = regions_names.map(
+        {name: normalize_region_name(name) for name in regions_names.unique()}
+    )
+    region[samples_ids.str.contains("SOUTH_AMERICA", regex=False)] = "SOUTH_AMERICA"
+
+    return pd.DataFrame(
+        {
+            "region": region.values,
+            "domain": domain.astype(object),
+            "id": fields.str[-1].astype(int).values,
+        }
+    )
+
+
+def build_predicate_df(columns, relation_id, with_details=True):
+    """Form the dataframe of a relation's results from their columns.
+
+    Args:
+        columns: The columns of the results (see results_utils.read_columns).
+        relation_id: The relation predicate.
+        with_details: Decode the valid objects, the top predictions and their probabilities.
     """
+    df = parse_uuids(columns["uuid"].tolist())
+    df.insert(2, "predicate", relation_id)
+    # The rank of the first valid object of each sample
+    df["rank"] = columns["ranks"][columns["ranks_offsets"][:-1]].astype(int)
+    df["subject"] = columns["sub_label"].tolist()
+
+    if with_details:
+        df["valid_objects"] = [
+            obj_labels.tolist()
+            for obj_labels in unflatten(
+                columns["obj_labels"], columns["obj_labels_offsets"]
+            )
+        ]
+        # Only the top predictions are stored
+        df["predictions"], df["probabilities"] = decode_predictions(columns)
 
-    def compute_probs(logits):
-        exps = np.exp(logits)
-        return exps / exps.sum()
-
-    # Load the pickle file
-    file_path = str(Path(results_dir, model_name, lang, relation_id, "result.pkl"))
-    with open(file_path, "rb") as f:
-        results = pickle.load(f)
-
-    predictions_list = []
-
-    for sample in results["list_of_results"]:
-        # Remove the "_REGION" from the sample name
-        sample_id = re.sub(r"_REGION", "", sample["uuid"])
-        fields = sample_id.split("_")
-
-        # Infer the domain from the sample ID
-        domains = [d for d in DOMAINS if d in sample_id]
-        domain = domains[0] if domains else "general"
-
-        region = (
-            normalize_region_name(fields[-2])
-            if not "SOUTH_AMERICA" in sample_id
-            else "SOUTH_AMERICA"
-        )
-        sample_id = int(fields[-1])
-        try:
-            rank = sample["masked_topk"]["ranks"][0]
-        except Exception as e:
-            from pprint import pprint
-
-            pprint(sample)
-            exit(0)
-        probs = compute_probs(sample["masked_topk"]["probs"])
+    return df
 
-        predictions_list.append(
-            {
-                "region": region,
-                "domain": domain,
-                "predicate": relation_id,
-                "id": sample_id,
-                "rank": rank,
-                "subject": sample["sample"]["sub_label"],
-                "valid_objects": sample["sample"]["obj_label"],
-                "predictions": sample["masked_topk"]["predicted"],
-                "probabilities": probs,
-            }
-        )
 
-    df = pd.DataFrame(predictions_list)
+def load_predicate_results(results_dir, relation_id, model_name, lang):
+    """
+    Return a dataframe of a model's predictions for a specific relation in a specific language.
+    """
 
-    return df
+    # Load the columnar results (or the pickle file of older results)
+    columns = read_columns(Path(results_dir, model_name, lang, relation_id))
+    return build_predicate_df(columns, relation_id)
 
 
 def load_model_results(results_dir, model_name, lang, relation_predicates=None):
 
-    #  Infer the predicates if not provided
+    #  Infer the predicates if not provided
     if not relation_predicates:
         relation_predicates = [
             Path(p).name
@@ -95,11 +113,228 @@ def load_model_results(results_dir, model_name, lang, relation_predicates=None):
     return pd.concat(predicates_results_df)
 
 
+def load_compact_predicate_results(log_directory, cache_file_path, relation_id):
+    """Load the dataframe of a relation's results without their details.
+
+    The dataframe is cached on the disk and is only rebuilt if the results file is modified.
+
+    Returns:
+        The modification time of the results file and the dataframe.
+    """
+    file_path = get_results_file_path(log_directory)
+    mtime = file_path.stat().st_mtime_ns
+
+    try:
+        with open(str(cache_file_path), "rb") as f:
+            cached_results = pickle.load(f)
+        if (
+            cached_results["source"] == file_path.name
+            and cached_results["mtime"] == mtime
+        ):
+            return mtime, cached_results["df"]
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+
+    columns = read_columns(log_directory)
+    df = build_predicate_df(columns, relation_id, with_details=False)
+
+    # Write to a temporary file first to avoid leaving partial entries behind
+    os.makedirs(cache_file_path.parent, exist_ok=True)
+    tmp_file_path = cache_file_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(str(tmp_file_path), "wb") as f:
+        pickle.dump({"source": file_path.name, "mtime": mtime, "df": df}, f)
+    os.replace(tmp_file_path, cache_file_path)
+
+    return mtime, df
+
+
+# The maximum number of processes loading the results files at once
+MAX_LOADING_WORKERS = 16
+
+
+class ResultsCatalog:
+    """A memoized loader of the models' results within a results directory.
+
+    The results of each (model, lang, relation) are decoded once into a compact dataframe (i.e.:
+    without the valid objects and the predictions), which is also cached on the disk until the
+    results file is modified.
+    """
+
+    def __init__(self, results_dir, cache_dir=None):
+        """
+        Args:
+            results_dir: The directory of the models' results.
+            cache_dir: The directory of the cached dataframes (within results_dir by default).
+        """
+        self.results_dir = results_dir
+        # Hidden directories are skipped when globbing the models' directories
+        self.cache_dir = (
+            Path(cache_dir) if cache_dir else Path(results_dir, ".catalog_cache")
+        )
+        # (model, lang, relation) -> (modification time of the results file, dataframe)
+        self.predicates_dfs = {}
+
+    def get_relation_predicates(self, model_name, lang):
+        return [
+            Path(p).name
+            for p in glob.glob(str(Path(self.results_dir, model_name, lang, "*")))
+        ]
+
+    def load_predicate_results(self, model_name, lang, relation_id, with_details=False):
+        """Return a dataframe of a model's predictions for a relation in a language.
+
+        Args:
+            with_details: Add the valid objects, the top predictions and their probabilities.
+        """
+        log_directory = Path(self.results_dir, model_name, lang, relation_id)
+        if with_details:
+            return build_predicate_df(read_columns(log_directory), relation_id)
+
+        key = (model_name, lang, relation_id)
+        if self.is_stale(key):
+            self.predicates_dfs[key] = load_compact_predicate_results(
+                *self.get_loading_arguments(key)
+            )
+        return self.predicates_dfs[key][1]
+
+    def is_stale(self, key):
+        """Check if the results of a (model, lang, relation) aren't loaded or were modified."""
+        log_directory = Path(self.results_dir, *key)
+        mtime = get_results_file_path(log_directory).stat().st_mtime_ns
+        return key not in self.predicates_dfs or self.predicates_dfs[key][0] != mtime
+
+    def get_loading_arguments(self, key):
+        """The arguments of load_compact_predicate_results for a (model, lang, relation)."""
+        model_name, lang, relation_id = key
+        return (
+            Path(self.results_dir, model_name, lang, relation_id),
+            Path(self.cache_dir, model_name, lang, f"{relation_id}.pkl"),
+            relation_id,
+        )
+
+    def load_results(self, models_names, langs, max_workers=None):
+        """Load the results of all the relations of several models and languages concurrently.
+
+        Args:
+            models_names: A list of models' names.
+            langs: A list of languages.
+            max_workers: The maximum number of processes loading the results files (by default,
+                the number of CPUs capped by MAX_LOADING_WORKERS).
+
+        Returns:
+            A dataframe of the compact results with "model_name" and "lang" columns.
+        """
+        keys = [
+            (model_name, lang, relation_id)
+            for model_name in models_names
+            for lang in langs
+            for relation_id in self.get_relation_predicates(model_name, lang)
+        ]
+
+        # Only the results that aren't memoized are decoded by the workers
+        stale_keys = [key for key in keys if self.is_stale(key)]
+        if not max_workers:
+            max_workers = min(MAX_LOADING_WORKERS, os.cpu_count() or 1)
+        max_workers = min(max_workers, len(stale_keys))
+
+        if max_workers > 1:
+            loading_arguments = [self.get_loading_arguments(key) for key in stale_keys]
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                stale_results = list(
+                    executor.map(
+                        load_compact_predicate_results, *zip(*loading_arguments)
+                    )
+                )
+        else:
+            stale_results = [
+                load_compact_predicate_results(*self.get_loading_arguments(key))
+                for key in stale_keys
+            ]
+
+        for key, result in zip(stale_keys, stale_results):
+            self.predicates_dfs[key] = result
+
+        return pd.concat(
+            [
+                self.predicates_dfs[key][1].assign(model_name=key[0], lang=key[1])
+                for key in keys
+            ],
+            ignore_index=True,
+        )
+
+    def load_model_results(
+        self, model_name, lang, relation_predicates=None, with_details=False
+    ):
+        #  Infer the predicates if not provided
+        if not relation_predicates:
+            relation_predicates = self.get_relation_predicates(model_name, lang)
+
+        return pd.concat(
+            [
+                self.load_predicate_results(
+                    model_name, lang, predicate, with_details=with_details
+                )
+                for predicate in relation_predicates
+            ]
+        )
+
+
+# The catalogs of the results directories used by this process
+RESULTS_CATALOGS = {}
+
+
+def get_results_catalog(results_dir):
+    """Return the catalog of a results directory (created once per process)."""
+    key = str(Path(results_dir).resolve())
+    if key not in RESULTS_CATALOGS:
+        RESULTS_CATALOGS[key] = ResultsCatalog(results_dir)
+    return RESULTS_CATALOGS[key]
+
+
+def get_P_at_1(number_correct, n_samples):
+    return round(100 * (number_correct / n_samples), 3)
+
+
 def compute_P_at_1(df):
     """Compute P@1 score for a dataframe of predictions."""
     number_correct = int((df["rank"] == 0).sum())
     n_samples = int(df.shape[0])
-    return round(100 * (number_correct / n_samples), 3)
+    return get_P_at_1(number_correct, n_samples)
+
+
+def count_correct_predictions(df):
+    """Count the correct predictions and the samples of each domain/predicate/region.
+
+    Returns:
+        A dictionary of (domain, predicate, region) -> (number of correct predictions, number of
+        samples), where None matches any value (e.g.: (None, "P17", None) for all the samples of
+        P17).
+    """
+    groups_counts = (
+        pd.DataFrame(
+            {
+                "domain": df["domain"].astype("category"),
+                "predicate": df["predicate"].astype("category"),
+                "region": df["region"].astype("category"),
+                "correct": df["rank"] == 0,
+            }
+        )
+        .groupby(["domain", "predicate", "region"], observed=True)["correct"]
+        .agg(["sum", "count"])
+    )
+
+    # Add the counts of each group to the counts of all the combinations it belongs to
+    counts = {}
+    for (domain, predicate, region), (number_correct, n_samples) in zip(
+        groups_counts.index, groups_counts.values
+    ):
+        for key in itertools.product((domain, None), (predicate, None), (region, None)):
+            key_number_correct, key_n_samples = counts.get(key, (0, 0))
+            counts[key] = (
+                key_number_correct + int(number_correct),
+                key_n_samples + int(n_samples),
+            )
+    return counts
 
 
 def compute_P_scores(
@@ -121,21 +356,29 @@ def compute_P_scores(
     if aggregation_method == "all":
         return {"P@1_aggregated": compute_P_at_1(df), "Support_aggregated": df.shape[0]}
 
-    #  Infer regions in case they are not provided
+    #  Infer regions in case they are not provided
     if not regions:
         regions = sorted(df["region"].unique())
     else:
         assert all([region in sorted(df["region"].unique()) for region in regions])
 
+    # All the scores are computed from the counts of a single pass over the dataframe
+    counts = count_correct_predictions(df)
+
+    def add_scores(scores, suffix, domain=None, predicate=None, region=None):
+        """Add the P@1 and the support of the matching samples (if any) to the scores."""
+        number_correct, n_samples = counts.get((domain, predicate, region), (0, 0))
+        scores[f"P@1_{suffix}"] = get_P_at_1(number_correct, n_samples)
+        scores[f"Support_{suffix}"] = n_samples
+
+    def has_samples(domain=None, predicate=None, region=None):
+        return (domain, predicate, region) in counts
+
     if aggregation_method == "split_by_region":
         scores = {}
         for region in regions:
-            region_df = df[df["region"] == region]
-
-            scores[f"P@1_{region}"] = compute_P_at_1(region_df)
-            scores[f"Support_{region}"] = region_df.shape[0]
-        scores["P@1_aggregated"] = compute_P_at_1(df)
-        scores["Support_aggregated"] = df.shape[0]
+            add_scores(scores, region, region=region)
+        add_scores(scores, "aggregated")
         return scores
 
     relation_predicates = [
@@ -147,15 +390,9 @@ def compute_P_scores(
         for relation_predicate in relation_predicates:
             scores = {}
             for region in regions:
-                region_df = df[
-                    (df["predicate"] == relation_predicate) & (df["region"] == region)
-                ]
-                scores[f"P@1_{region}"] = compute_P_at_1(region_df)
-                scores[f"Support_{region}"] = region_df.shape[0]
+                add_scores(scores, region, predicate=relation_predicate, region=region)
 
-            relation_df = df[df["predicate"] == relation_predicate]
-            scores["P@1_aggregated"] = compute_P_at_1(relation_df)
-            scores["Support_aggregated"] = relation_df.shape[0]
+            add_scores(scores, "aggregated", predicate=relation_predicate)
 
             scores["predicate"] = relation_predicate
             scores["domain"] = relation_predicate
@@ -168,41 +405,20 @@ def compute_P_scores(
     if aggregation_method == "split_by_domain":
         results = []
         for domain in domains:
-            domain_df = df[df["domain"] == domain]
-            for relation_predicate in relation_predicates:
+            # The rows of each predicate within the domain, then the domain's aggregated row
+            for relation_predicate in relation_predicates + [None]:
                 scores = {}
                 for region in regions:
-                    predicate_region_df = domain_df[
-                        (domain_df["predicate"] == relation_predicate)
-                        & (domain_df["region"] == region)
-                    ]
-                    if predicate_region_df.shape[0]:
-                        scores[f"P@1_{region}"] = compute_P_at_1(predicate_region_df)
-                        scores[f"Support_{region}"] = predicate_region_df.shape[0]
-
-                relation_df = domain_df[domain_df["predicate"] == relation_predicate]
-                if relation_df.shape[0]:
-                    scores["P@1_aggregated"] = compute_P_at_1(relation_df)
-                    scores["Support_aggregated"] = relation_df.shape[0]
-
-                    scores["predicate"] = relation_predicate
+                    if has_samples(domain, relation_predicate, region):
+                        add_scores(scores, region, domain, relation_predicate, region)
+
+                if has_samples(domain, relation_predicate):
+                    add_scores(scores, "aggregated", domain, relation_predicate)
+
+                    scores["predicate"] = (
+                        relation_predicate if relation_predicate else "Aggregated"
+                    )
                     scores["domain"] = domain
                     results.append(scores)
 
-            # TODO: Avoid copy-pasting here!
-            scores = {}
-            for region in regions:
-                domain_region_df = domain_df[(domain_df["region"] == region)]
-                if domain_region_df.shape[0]:
-                    scores[f"P@1_{region}"] = compute_P_at_1(domain_region_df)
-                    scores[f"Support_{region}"] = domain_region_df.shape[0]
-
-            if domain_df.shape[0]:
-                scores["P@1_aggregated"] = compute_P_at_1(domain_df)
-                scores["Support_aggregated"] = domain_df.shape[0]
-
-                scores["predicate"] = "Aggregated"
-                scores["domain"] = domain
-                results.append(scores)
-
         return results
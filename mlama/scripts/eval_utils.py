@@ -4,63 +4,254 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 #
+import glob
 import json
+import hashlib
 import torch
-import pickle
+import torch.nn.functional as F
 from tqdm import tqdm
 import modules.base_connector as base
-import multiprocessing
-from multiprocessing.pool import ThreadPool
 import numpy as np
 import utils
+from results_utils import ResultsStreamWriter, get_config_fingerprint
 
 
-def get_ranking(
-    log_probs, sample, masked_tokens_indecies, candidate_objects_dict,
-):
-    experiment_result = {}
-    objects_probabilities = {}
-    objects_true = sample["obj_label"]
-
-    # Make sure the type of objects_true is a list
-    if type(objects_true) == type(""):
-        objects_true = [objects_true]
-
-    for i, num_masks in enumerate(candidate_objects_dict):
-        # Find the range of the masked indecies
-        masked_indecies = masked_tokens_indecies[i]
-
-        # Extract the probabilities of subwords in the range of the masked tokens
-        predictions = log_probs[i][masked_indecies]
-
-        for object in candidate_objects_dict[num_masks]:
-            object_subword_probabiltiies = [
-                prediction[subword_id]
-                for subword_id, prediction in zip(
-                    candidate_objects_dict[num_masks][object], predictions
-                )
+def get_candidates_matrices(candidate_objects_dict):
+    """Stack the subword ids of the candidate objects of each number of masks into a matrix.
+
+    Args:
+        candidate_objects_dict: A dictionary of number of masks -> object -> subword ids.
+
+    Returns:
+        The sorted list of the subword ids of all the candidates, and a list of dictionaries (one
+        for each number of masks having candidates) of the number of masks, the index of the
+        template having this number of masks, the list of objects, a padded [objects, masks]
+        tensor of the indecies of their subwords within the list of subword ids, and a
+        [objects, masks] boolean tensor of the valid subwords.
+    """
+    # Subwords beyond the number of masks can't be predicted
+    objects_ids_dict = {
+        num_masks: {
+            object: list(objects_ids[object])[:num_masks] for object in objects_ids
+        }
+        for num_masks, objects_ids in candidate_objects_dict.items()
+    }
+    vocab_indices = sorted(
+        set(
+            [
+                subword_id
+                for objects_ids in objects_ids_dict.values()
+                for object_ids in objects_ids.values()
+                for subword_id in object_ids
+            ]
+        )
+    )
+    inverse_vocab_indices = {
+        subword_id: i for i, subword_id in enumerate(vocab_indices)
+    }
+
+    candidates_matrices = []
+    for num_masks, objects_ids in objects_ids_dict.items():
+        if not objects_ids:
+            continue
+
+        objects = list(objects_ids)
+        ids = torch.zeros((len(objects), num_masks), dtype=torch.long)
+        valid = torch.zeros((len(objects), num_masks), dtype=torch.bool)
+        for object_index, object in enumerate(objects):
+            object_ids = [
+                inverse_vocab_indices[subword_id] for subword_id in objects_ids[object]
             ]
-            objects_probabilities[object] = np.mean(object_subword_probabiltiies)
+            ids[object_index, : len(object_ids)] = torch.tensor(
+                object_ids, dtype=torch.long
+            )
+            valid[object_index, : len(object_ids)] = True
+
+        candidates_matrices.append(
+            {
+                "num_masks": num_masks,
+                # Templates are only formed for the numbers of masks having candidates
+                "template_index": len(candidates_matrices),
+                "objects": objects,
+                "ids": ids,
+                "valid": valid,
+            }
+        )
+    return vocab_indices, candidates_matrices
+
 
-    # Sort the dictionary by the probabilities of the candidate objects
-    sorted_objects_probabilities = sorted(
-        objects_probabilities.items(), key=lambda t: t[1], reverse=True
+def score_candidates(log_probs, masked_tokens_indecies_list, candidates_matrix):
+    """Compute the mean log probability of the subwords of each candidate object.
+
+    Args:
+        log_probs: A [batch, templates, max_masks, subwords] tensor of the log probabilities of
+            the candidates' subwords at the masked tokens of each template.
+        masked_tokens_indecies_list: A list of the masked indecies of each template for each sample.
+        candidates_matrix: The candidates of a single number of masks (see get_candidates_matrices).
+
+    Returns:
+        A [batch, objects] tensor of the scores of the candidate objects.
+    """
+    num_masks = candidates_matrix["num_masks"]
+    template_index = candidates_matrix["template_index"]
+    max_masks = log_probs.shape[2]
+
+    # The masked tokens found within the template with `num_masks` masks
+    valid_positions = torch.tensor(
+        [
+            [
+                position < len(masked_tokens_indecies[template_index])
+                for position in range(num_masks)
+            ]
+            for masked_tokens_indecies in masked_tokens_indecies_list
+        ],
+        dtype=torch.bool,
     )
 
-    # Ranks of all true objects
-    ranks = [
-        i for i, t in enumerate(sorted_objects_probabilities) if t[0] in objects_true
+    device = log_probs.device
+    # [batch, num_masks, subwords]
+    predictions = log_probs[
+        :,
+        template_index,
+        torch.arange(num_masks, device=device).clamp(max=max_masks - 1),
     ]
 
+    # Gather the probability of the i-th subword of each object from the i-th mask
+    # [batch, objects, num_masks]
+    objects_subwords_log_probs = predictions[
+        :,
+        torch.arange(num_masks, device=device)[None, :],
+        candidates_matrix["ids"].to(device),
+    ]
+    valid = candidates_matrix["valid"].to(device)[None, :, :] & valid_positions.to(
+        device
+    )[:, None, :]
+
+    objects_subwords_log_probs = objects_subwords_log_probs.masked_fill(~valid, 0)
+    return objects_subwords_log_probs.sum(dim=-1) / valid.sum(dim=-1).clamp(min=1)
+
+
+def rank_candidates(objects, scores, objects_true):
+    """Rank the candidate objects by their scores.
+
+    Args:
+        objects: A list of the candidate objects.
+        scores: A numpy array of the scores of the objects.
+        objects_true: The list of valid objects.
+
+    Returns:
+        A dictionary of the ranks and probabilities of the valid objects and the sorted predictions.
+    """
+    experiment_result = {}
+    objects_true = set(objects_true)
+
+    # The order of objects having the same score is kept (i.e.: stable sorting)
+    sorted_indecies = np.argsort(-scores, kind="stable")
+
+    # Ranks of all true objects, computed by counting the objects preceding them
+    ranks = sorted(
+        [
+            int((scores > scores[i]).sum() + (scores[:i] == scores[i]).sum())
+            for i, object in enumerate(objects)
+            if object in objects_true
+        ]
+    )
+
+    predicted = [objects[i] for i in sorted_indecies]
+    probs = scores[sorted_indecies].tolist()
+
     experiment_result["ranks"] = ranks
-    experiment_result["prob_true"] = [sorted_objects_probabilities[r] for r in ranks]
-    experiment_result["predicted"] = [t[0] for t in sorted_objects_probabilities]
-    experiment_result["probs"] = [t[1] for t in sorted_objects_probabilities]
+    experiment_result["prob_true"] = [(predicted[r], probs[r]) for r in ranks]
+    experiment_result["predicted"] = predicted
+    experiment_result["probs"] = probs
 
     return experiment_result
 
 
-def run_evaluation(args, NUM_MASK, candidate_objects_dict, model=None):
+def get_batch_ranking(
+    log_probs, samples, masked_tokens_indecies_list, candidates_matrices
+):
+    """Rank the candidate objects for each sample of a batch.
+
+    Args:
+        log_probs: A [batch, templates, max_masks, subwords] tensor of the log probabilities of
+            the candidates' subwords at the masked tokens of each template.
+        samples: A list of the samples of the batch.
+        masked_tokens_indecies_list: A list of the masked indecies of each template for each sample.
+        candidates_matrices: The candidate objects (see get_candidates_matrices).
+
+    Returns:
+        A list of the ranking results of the samples.
+    """
+    objects = [
+        object
+        for candidates_matrix in candidates_matrices
+        for object in candidates_matrix["objects"]
+    ]
+    # [batch, objects]
+    scores = torch.cat(
+        [
+            score_candidates(log_probs, masked_tokens_indecies_list, candidates_matrix)
+            for candidates_matrix in candidates_matrices
+        ],
+        dim=1,
+    )
+    scores = scores.cpu().numpy()
+
+    batch_ranking_results = []
+    for sample, sample_scores in zip(samples, scores):
+        objects_true = sample["obj_label"]
+
+        # Make sure the type of objects_true is a list
+        if type(objects_true) == type(""):
+            objects_true = [objects_true]
+
+        batch_ranking_results.append(
+            rank_candidates(objects, sample_scores, objects_true)
+        )
+    return batch_ranking_results
+
+
+def get_ranking(log_probs, sample, masked_tokens_indecies, candidate_objects_dict):
+    """Rank the candidate objects of a single sample (see get_batch_ranking).
+
+    Args:
+        log_probs: A [templates, tokens, vocab] tensor of the log probabilities of each template
+            (i.e.: one template for each number of masks of candidate_objects_dict).
+        sample: The sample whose objects are ranked.
+        masked_tokens_indecies: A list of the masked indecies of each template.
+        candidate_objects_dict: A dictionary of number of masks -> object -> subword ids.
+
+    Returns:
+        A dictionary of the ranks and probabilities of the valid objects and the sorted predictions.
+    """
+    vocab_indices, candidates_matrices = get_candidates_matrices(
+        candidate_objects_dict
+    )
+    masks_counts = list(candidate_objects_dict)
+    templates_indecies = [
+        masks_counts.index(candidates_matrix["num_masks"])
+        for candidates_matrix in candidates_matrices
+    ]
+    masked_tokens_indecies = [masked_tokens_indecies[i] for i in templates_indecies]
+
+    # Keep the log probabilities of the candidates' subwords at the masked tokens
+    max_masks = max([len(masked_indecies) for masked_indecies in masked_tokens_indecies])
+    masked_log_probs = torch.zeros(
+        (1, len(templates_indecies), max(1, max_masks), len(vocab_indices))
+    )
+    for template_index, i in enumerate(templates_indecies):
+        masked_indecies = masked_tokens_indecies[template_index]
+        masked_log_probs[0, template_index, : len(masked_indecies)] = torch.as_tensor(
+            log_probs[i]
+        )[masked_indecies][:, vocab_indices]
+
+    return get_batch_ranking(
+        masked_log_probs, [sample], [masked_tokens_indecies], candidates_matrices
+    )[0]
+
+
+def run_evaluation(args, candidate_objects_dict, model=None):
     model_name = args.model_name.title()
 
     # initialize logging
@@ -99,15 +290,68 @@ def run_evaluation(args, NUM_MASK, candidate_objects_dict, model=None):
             args.template.strip(), sample["sub_label"].strip(), base.MASK
         )
 
-    samples_batches = utils.batchify(all_samples, args.batch_size)
+    # A previous run is only resumed if its results were computed the same way
+    # (dataset_filename is a glob pattern of the relation's files for DLAMA)
+    dataset_hash = hashlib.sha256()
+    for file in sorted(glob.glob(str(args.dataset_filename))):
+        with open(file, "rb") as f:
+            dataset_hash.update(f.read())
+    fingerprint = get_config_fingerprint(
+        {
+            "model": args.bert_model_name,
+            "template": args.template,
+            "dataset": dataset_hash.hexdigest(),
+            "lowercase": args.lowercase,
+            "top_k": args.top_k,
+            "candidates": candidate_objects_dict,
+        }
+    )
+
+    # The results are appended to a stream after each batch, so a previous run of the relation
+    # is resumed by skipping the samples it already stored
+    results_writer = ResultsStreamWriter(
+        log_directory,
+        top_k=args.top_k,
+        resume=args.resume,
+        fingerprint=fingerprint,
+        logger=logger,
+    )
+    if results_writer.uuids:
+        logger.info(
+            "resuming after {} samples scored by a previous run...".format(
+                len(results_writer.uuids)
+            )
+        )
+        all_samples = [
+            sample for sample in all_samples if sample["uuid"] not in results_writer.uuids
+        ]
+
+    # The scoring is vectorized, so torch uses all the available threads by default
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
 
-    # ThreadPool
-    num_threads = args.threads
-    if num_threads <= 0:
-        # use all available threads
-        num_threads = multiprocessing.cpu_count()
-    pool = ThreadPool(num_threads)
-    list_of_results = []
+    # Stack the subword ids of the candidates once for all the batches
+    vocab_indices, candidates_matrices = get_candidates_matrices(
+        candidate_objects_dict
+    )
+    # Skip the numbers of masks that have no candidates
+    masks_counts = [
+        candidates_matrix["num_masks"] for candidates_matrix in candidates_matrices
+    ]
+    num_templates = len(masks_counts)
+
+    if args.max_batch_tokens:
+        # The [CLS] and [SEP] tokens are added to the longest template of each sample
+        samples_batches = utils.batchify_by_tokens(
+            all_samples,
+            # Each sample is fed to the model once for each template
+            max(1, args.max_batch_tokens // num_templates),
+            lambda sample: len(model.tokenizer.tokenize(sample["masked_sentence"]))
+            + max(masks_counts)
+            + 1,
+        )
+    else:
+        samples_batches = utils.batchify(all_samples, args.batch_size)
 
     for i in tqdm(range(len(samples_batches))):
         samples_b = samples_batches[i]
@@ -118,7 +362,7 @@ def run_evaluation(args, NUM_MASK, candidate_objects_dict, model=None):
         # with different number of masked tokens
         for i, sample in enumerate(samples_b):
             masked_sentences = []
-            for num_mask in range(1, NUM_MASK + 1):
+            for num_mask in masks_counts:
                 sentence = sample["masked_sentence"]
                 sentence = sentence.replace(base.MASK, base.MASK * num_mask)
                 sentence = sentence.replace("][", "] [")
@@ -126,127 +370,214 @@ def run_evaluation(args, NUM_MASK, candidate_objects_dict, model=None):
                 sentences_b.append([sentence])
             samples_b[i]["masked_sentences"] = masked_sentences
 
-        #  Fill the masks for all the templates of the current batch
+        #  Fill the masks for all the templates of the current batch
+        # (only the log probabilities of the candidates' subwords are kept)
         (
-            original_log_probs_tensor,
-            tokens_ids_list,
+            masked_log_probs_tensor,
             indecies_of_masked_tokens_list,
-        ) = model.get_batch_generation(sentences_b, logger=logger)
+        ) = model.get_batch_masked_log_probs(
+            sentences_b, vocab_indices, logger=logger
+        )
 
         # Group the templates of each sample
         dim_reshape = (
             current_batch_size,
-            NUM_MASK,
-            original_log_probs_tensor.shape[1],
-            original_log_probs_tensor.shape[2],
-        )
-        original_log_probs_tensor = torch.reshape(
-            original_log_probs_tensor, dim_reshape
+            num_templates,
+            masked_log_probs_tensor.shape[1],
+            masked_log_probs_tensor.shape[2],
         )
+        masked_log_probs_tensor = torch.reshape(masked_log_probs_tensor, dim_reshape)
+
         #  Group the indecies of masked tokens of each sample
         indecies_of_masked_tokens_list = [
             indecies_of_masked_tokens_list[
-                sample_index * NUM_MASK : (sample_index + 1) * NUM_MASK
+                sample_index * num_templates : (sample_index + 1) * num_templates
             ]
-            for sample_index in range(len(indecies_of_masked_tokens_list))
+            for sample_index in range(current_batch_size)
         ]
 
-        ranking_function_arguments = [
-            (
-                original_log_probs,
-                sample,
-                masked_tokens_indecies,
-                candidate_objects_dict,
-            )
-            for sample, original_log_probs, masked_tokens_indecies in zip(
-                samples_b, original_log_probs_tensor, indecies_of_masked_tokens_list,
-            )
-        ]
-
-        # Run the ranking computation in parallel for the samples in the batch!
-        batch_ranking_results = pool.starmap(get_ranking, ranking_function_arguments)
+        batch_ranking_results = get_batch_ranking(
+            masked_log_probs_tensor,
+            samples_b,
+            indecies_of_masked_tokens_list,
+            candidates_matrices,
+        )
 
         assert len(batch_ranking_results) == len(samples_b)
 
+        batch_results = []
         for sample, batch_ranking_result in zip(samples_b, batch_ranking_results):
             element = {
                 "sample": sample,
                 "uuid": sample["uuid"],
                 "masked_topk": batch_ranking_result,
             }
-            # Add the sample results to a list
-            list_of_results.append(element)
+            batch_results.append(element)
 
-    pool.close()
-    pool.join()
+        # Commit the top predictions of the batch
+        results_writer.write_batch(batch_results)
 
-    # dump pickle with the result of the experiment
-    all_results = dict(list_of_results=list_of_results)
-    with open("{}/result.pkl".format(log_directory), "wb") as f:
-        pickle.dump(all_results, f)
+    results_writer.close()
 
 
-def get_T5_ranking(model, tokenizer, candidate_answers, prompt, device):
-    """Rank the answers according to their probability of filling the masked object.
+# The default number of decoder tokens (i.e.: rows x target length) of a batch
+T5_MAX_BATCH_TOKENS = 1024
+
+
+def get_T5_answers_labels(tokenizer, candidate_answers):
+    """Tokenize the candidate answers as the targets of the masked span.
 
     Args:
-        model: A T5 model
-        tokenizer: The model's tokenizer
+        tokenizer: The T5 model's tokenizer
         candidate_answers: A list of strings for all the candidate answers
-        prompt: The manual prompt used to probe the model
-        device: The GPU to use or "cpu"
 
     Returns:
-        The answers with their corresponding probabilities.
+        A [answers, tokens] tensor of the padded target ids of the answers, and a boolean tensor
+        of the same shape marking the tokens of the answers themselves.
     """
-    #  Replace the span for the object within the template
-    input_ids = tokenizer(
-        prompt.replace("[Y]", "<extra_id_0>"), return_tensors="pt"
+    labels = tokenizer(
+        ["<extra_id_0> " + answer + " <extra_id_1>" for answer in candidate_answers],
+        return_tensors="pt",
+        padding=True,
     ).input_ids
 
-    # Tokenize the different answers for the span
-    answers_probabilities = {}
+    # Find the ids of the extra tokens
+    EXTRA_ID_0_index = tokenizer("<extra_id_0>").input_ids[0]
+    EXTRA_ID_1_index = tokenizer("<extra_id_1>").input_ids[0]
 
-    # TODO: Make this an argument to the function
-    BATCH_SIZE = 128
-    for i in tqdm(range(0, len(candidate_answers), BATCH_SIZE)):
-        answers = candidate_answers[i : i + BATCH_SIZE]
-        labels = tokenizer(
-            ["<extra_id_0> " + answer + " <extra_id_1>" for answer in answers],
-            return_tensors="pt",
-            padding=True,
-        ).input_ids
+    # The first token is always <extra_id_0>
+    assert bool((labels[:, 0] == EXTRA_ID_0_index).all())
 
-        # Output in the form (Queries, Token Index, Value in Vocab)
-        # T5 generates an output in the form "<extra_id_0> 'answer' <extra_id_1>"
-        outputs = model(
-            input_ids=torch.concat([input_ids for _ in range(len(answers))]).to(device),
-            labels=labels.to(device),
-        ).logits
+    # Only use the tokens after the <extra_id_0> and before the first <extra_id_1>
+    answers_tokens_mask = torch.cumsum(labels == EXTRA_ID_1_index, dim=1) == 0
+    answers_tokens_mask[:, 0] = False
+
+    return labels, answers_tokens_mask
 
-        # Find the ids of the extra tokens
-        EXTRA_ID_0_index = tokenizer("<extra_id_0>").input_ids[0]
-        EXTRA_ID_1_index = tokenizer("<extra_id_1>").input_ids[0]
 
-        for answer_id in range(len(answers)):
-            target_ids = labels[answer_id]
-            answer_subword_probabilities = []
+def get_T5_rankings(
+    model,
+    tokenizer,
+    candidate_answers,
+    prompts,
+    device,
+    answers_labels=None,
+    max_batch_tokens=T5_MAX_BATCH_TOKENS,
+):
+    """Rank the answers according to their probability of filling the masked object of each prompt.
+
+    Args:
+        model: A T5 model
+        tokenizer: The model's tokenizer
+        candidate_answers: A list of strings for all the candidate answers
+        prompts: A list of the manual prompts used to probe the model
+        device: The GPU to use or "cpu"
+        answers_labels: The output of get_T5_answers_labels for the candidate answers (if cached)
+        max_batch_tokens: The maximum number of decoder tokens of a batch of (prompt, answer) pairs
+
+    Returns:
+        A list of dictionaries of the answers with their corresponding probabilities for each prompt.
+    """
+    if answers_labels is None:
+        answers_labels = get_T5_answers_labels(tokenizer, candidate_answers)
+    labels, answers_tokens_mask = answers_labels
+
+    #  Replace the span for the object within the templates
+    inputs = tokenizer(
+        [prompt.replace("[Y]", "<extra_id_0>") for prompt in prompts],
+        return_tensors="pt",
+        padding=True,
+    )
+
+    # Each prompt is only encoded once for all the answers
+    encoder_hidden_states = []
+    prompts_batch_size = max(1, max_batch_tokens // inputs.input_ids.shape[1])
+    with torch.no_grad():
+        for i in range(0, len(prompts), prompts_batch_size):
+            batch_input_ids = inputs.input_ids[i : i + prompts_batch_size]
+            batch_attention_mask = inputs.attention_mask[i : i + prompts_batch_size]
+            encoder_hidden_states.append(
+                model.get_encoder()(
+                    input_ids=batch_input_ids.to(device),
+                    attention_mask=batch_attention_mask.to(device),
+                ).last_hidden_state
+            )
+    encoder_hidden_states = torch.cat(encoder_hidden_states, dim=0)
+    encoder_attention_mask = inputs.attention_mask.to(device)
+
+    # Group the answers having similar lengths to reduce the padding
+    answers_lengths = (labels != tokenizer.pad_token_id).sum(dim=1)
+    sorted_answers_indices = torch.argsort(answers_lengths)
+    sorted_answers_lengths = answers_lengths[sorted_answers_indices].tolist()
+
+    # The (prompt, answer) pairs are ordered by the length of their answers
+    n_prompts = len(prompts)
+    n_pairs = n_prompts * len(candidate_answers)
+
+    def get_batch_size(pair_index):
+        """The number of pairs within the budget if padded to the answer of this pair."""
+        answer_length = sorted_answers_lengths[pair_index // n_prompts]
+        return max(1, max_batch_tokens // answer_length)
+
+    scores = torch.zeros((n_prompts, len(candidate_answers)))
+    progress_bar = tqdm(total=n_pairs)
+    start = 0
+    while start < n_pairs:
+        # The batch is padded to the length of its longest (i.e.: last) answer
+        end = min(n_pairs, start + get_batch_size(start))
+        end = min(end, start + get_batch_size(end - 1))
+        pairs_indices = torch.arange(start, end)
+        prompts_indices = pairs_indices % n_prompts
+        answers_indices = sorted_answers_indices[pairs_indices // n_prompts]
+        max_length = sorted_answers_lengths[(end - 1) // n_prompts]
+
+        batch_labels = labels[answers_indices, :max_length].to(device)
+        batch_answers_tokens_mask = answers_tokens_mask[answers_indices, :max_length]
+        batch_answers_tokens_mask = batch_answers_tokens_mask.to(device)
 
-            for idx, t_idx in enumerate(target_ids):
-                # Skip the first t_idx which is always <extra_id_0>
-                if idx == 0:
-                    assert t_idx == EXTRA_ID_0_index
-                    continue
+        # Output in the form (Queries, Token Index, Value in Vocab)
+        # T5 generates an output in the form "<extra_id_0> 'answer' <extra_id_1>"
+        with torch.no_grad():
+            logits = model(
+                encoder_outputs=(
+                    encoder_hidden_states[prompts_indices.to(device)],
+                ),
+                attention_mask=encoder_attention_mask[prompts_indices.to(device)],
+                labels=batch_labels,
+            ).logits
+
+        # The log probability of each target token
+        targets_log_probs = (
+            F.log_softmax(logits.float(), dim=-1)
+            .gather(dim=-1, index=batch_labels.unsqueeze(-1))
+            .squeeze(-1)
+        )
+        answers_scores = -(targets_log_probs * batch_answers_tokens_mask).sum(
+            dim=1
+        ) / batch_answers_tokens_mask.sum(dim=1)
+        scores[prompts_indices, answers_indices] = answers_scores.cpu()
+
+        progress_bar.update(end - start)
+        start = end
+    progress_bar.close()
+
+    return [
+        dict(zip(candidate_answers, prompt_scores))
+        for prompt_scores in scores.tolist()
+    ]
 
-                #  Stop computing the probabilities just before the <extra_id_1>
-                if t_idx == EXTRA_ID_1_index:
-                    break
 
-                logits = outputs[answer_id, idx, :]
-                probs = logits.cpu().softmax(dim=-1).detach().numpy()
-                answer_subword_probabilities.append(-np.log(probs[t_idx]))
+def get_T5_ranking(model, tokenizer, candidate_answers, prompt, device):
+    """Rank the answers according to their probability of filling the masked object.
 
-            answer_probability = np.mean(answer_subword_probabilities)
-            answers_probabilities[answers[answer_id]] = answer_probability
+    Args:
+        model: A T5 model
+        tokenizer: The model's tokenizer
+        candidate_answers: A list of strings for all the candidate answers
+        prompt: The manual prompt used to probe the model
+        device: The GPU to use or "cpu"
 
-    return answers_probabilities
+    Returns:
+        The answers with their corresponding probabilities.
+    """
+    return get_T5_rankings(model, tokenizer, candidate_answers, [prompt], device)[0]
@@ -1,10 +1,21 @@
 import os
 import re
+import copy
 import json
+import torch
+import numpy as np
+import torch.nn.functional as F
 from tqdm import tqdm
 from pathlib import Path
 from argparse import ArgumentParser
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+from eval_utils import rank_candidates
+from results_utils import write_results, DEFAULT_TOP_K
 
 
 PROMPTS = {
@@ -125,27 +136,251 @@ def save_jsonl_file(file_path, tuples):
             f.write(json.dumps(t, ensure_ascii=False) + "\n")
 
 
-def get_bloom_output(predicate, entity, lang, model, tokenizer):
-    """Answer a question using bloom model loaded on the GPU."""
-    prompt = PROMPTS[predicate][lang].format(entity)
+class EndOfAnswerCriteria(StoppingCriteria):
+    """Stop generating once all the completions of a batch have ended their first line."""
 
-    inputs = tokenizer((prompt), return_tensors="pt").to("cuda")
-    outputs_ids = model.generate(**inputs, max_new_tokens=40)
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        # Only the tokens generated since the previous step are decoded
+        self.processed_length = prompt_length
+        self.started = None
+        self.ended = None
 
-    outputs_strs = tokenizer.batch_decode(outputs_ids)
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.ended is None:
+            self.started = [False for _ in range(input_ids.shape[0])]
+            self.ended = [False for _ in range(input_ids.shape[0])]
 
-    return outputs_strs
+        new_ids = input_ids[:, self.processed_length :].tolist()
+        self.processed_length = input_ids.shape[1]
+        for i, ids in enumerate(new_ids):
+            for token_id in ids:
+                if self.ended[i]:
+                    break
+                if token_id == self.tokenizer.eos_token_id:
+                    self.ended[i] = True
+                    break
 
+                token = self.tokenizer.decode([token_id], skip_special_tokens=True)
+                # The whitespaces preceding the answer don't end it
+                if not self.started[i]:
+                    token = token.lstrip()
+                self.ended[i] = "\n" in token
+                self.started[i] = self.started[i] or token != ""
+        return all(self.ended)
 
-def get_bloom_predictions(predicate, lang, model, tokenizer, triples):
-    for triple in tqdm(triples):
-        bloom_completion = get_bloom_output(
-            predicate, triple["sub_label"], lang, model, tokenizer
-        )[0]
-        triple["prediction"] = bloom_completion
+
+def cut_completion(completion):
+    """Keep the first non-empty line of a completion."""
+    return completion.lstrip().split("\n")[0]
+
+
+def get_bloom_outputs(prompts, model, tokenizer, device, max_new_tokens=40):
+    """Answer a batch of questions using bloom model loaded on the device.
+
+    Returns:
+        The completions of the prompts (i.e.: without the prompts).
+    """
+    # Pad the prompts from the left so that the completions follow them directly
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(device)
+    prompt_length = inputs["input_ids"].shape[1]
+    outputs_ids = model.generate(
+        **inputs,
+        max_new_tokens=max_new_tokens,
+        pad_token_id=tokenizer.pad_token_id,
+        stopping_criteria=StoppingCriteriaList(
+            [EndOfAnswerCriteria(tokenizer, prompt_length)]
+        ),
+    )
+
+    return tokenizer.batch_decode(
+        outputs_ids[:, prompt_length:], skip_special_tokens=True
+    )
+
+
+def get_bloom_predictions(
+    predicate, lang, model, tokenizer, triples, device="cuda", batch_size=8
+):
+    """Complete the prompts of the triples.
+
+    Returns:
+        The triples with the prompt followed by its whole completion as the "prediction" and the
+        first line of the completion as the "answer".
+    """
+    prompts = [PROMPTS[predicate][lang].format(triple["sub_label"]) for triple in triples]
+
+    # Group the prompts having the same number of tokens to avoid padding
+    prompts_lengths = [len(input_ids) for input_ids in tokenizer(prompts)["input_ids"]]
+    sorted_indices = sorted(range(len(prompts)), key=lambda i: prompts_lengths[i])
+
+    for batch_start in tqdm(range(0, len(sorted_indices), batch_size)):
+        batch_indices = sorted_indices[batch_start : batch_start + batch_size]
+        bloom_completions = get_bloom_outputs(
+            [prompts[i] for i in batch_indices], model, tokenizer, device
+        )
+        for i, bloom_completion in zip(batch_indices, bloom_completions):
+            # The generation stops once all the answers of the batch are complete
+            triples[i]["prediction"] = prompts[i] + bloom_completion
+            triples[i]["answer"] = cut_completion(bloom_completion)
     return triples
 
 
+def repeat_past_key_values(past_key_values, repeats):
+    """Repeat the cached keys and values of a single prompt for a batch of candidates."""
+    if hasattr(past_key_values, "batch_repeat_interleave"):
+        # Cache objects are extended in place by the forward pass
+        past_key_values = copy.deepcopy(past_key_values)
+        past_key_values.batch_repeat_interleave(repeats)
+        return past_key_values
+    return tuple(
+        tuple(
+            tensor.repeat(repeats, *[1 for _ in range(tensor.dim() - 1)])
+            for tensor in layer_past
+        )
+        for layer_past in past_key_values
+    )
+
+
+def get_bloom_candidates_scores(
+    prompt, candidates_ids, model, tokenizer, device, batch_size=8
+):
+    """Compute the mean log-likelihood of the tokens of each candidate following the prompt.
+
+    Args:
+        prompt: The prompt of a triple.
+        candidates_ids: A list of the token ids of each candidate.
+        model: A causal language model.
+        tokenizer: The model's tokenizer.
+        device: The device the model is loaded on.
+        batch_size: The number of candidates to score at once.
+
+    Returns:
+        A list of the scores of the candidates.
+    """
+    # The prompt is only computed once for all the candidates
+    inputs = tokenizer(prompt, return_tensors="pt").to(device)
+    prompt_length = inputs["input_ids"].shape[1]
+    with torch.no_grad():
+        prompt_outputs = model(**inputs, use_cache=True)
+    # The distribution of the first token of the candidates
+    first_token_log_probs = F.log_softmax(prompt_outputs.logits[0, -1].float(), dim=-1)
+
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    scores = []
+    for batch_start in range(0, len(candidates_ids), batch_size):
+        batch_candidates_ids = candidates_ids[batch_start : batch_start + batch_size]
+        max_length = max([len(ids) for ids in batch_candidates_ids])
+
+        # Pad the candidates from the right so that they directly follow the prompt
+        input_ids = torch.full(
+            (len(batch_candidates_ids), max_length), pad_token_id, dtype=torch.long
+        )
+        candidates_mask = torch.zeros(
+            (len(batch_candidates_ids), max_length), dtype=torch.long
+        )
+        for i, ids in enumerate(batch_candidates_ids):
+            input_ids[i, : len(ids)] = torch.tensor(ids, dtype=torch.long)
+            candidates_mask[i, : len(ids)] = 1
+        input_ids = input_ids.to(device)
+        candidates_mask = candidates_mask.to(device)
+        attention_mask = torch.cat(
+            [
+                torch.ones(
+                    (len(batch_candidates_ids), prompt_length),
+                    dtype=torch.long,
+                    device=device,
+                ),
+                candidates_mask,
+            ],
+            dim=1,
+        )
+
+        with torch.no_grad():
+            logits = model(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=repeat_past_key_values(
+                    prompt_outputs.past_key_values, len(batch_candidates_ids)
+                ),
+            ).logits
+
+        # The i-th token of the candidates is predicted from the (i-1)-th one
+        log_probs = torch.cat(
+            [
+                first_token_log_probs.expand(len(batch_candidates_ids), 1, -1),
+                F.log_softmax(logits[:, :-1].float(), dim=-1),
+            ],
+            dim=1,
+        )
+        tokens_log_probs = log_probs.gather(
+            dim=-1, index=input_ids.unsqueeze(-1)
+        ).squeeze(-1)
+        candidates_log_likelihood = (tokens_log_probs * candidates_mask).sum(dim=1)
+        scores += (candidates_log_likelihood / candidates_mask.sum(dim=1)).cpu().tolist()
+    return scores
+
+
+def get_bloom_rankings(
+    predicate, lang, model, tokenizer, triples, device="cuda", batch_size=8
+):
+    """Rank the objects of all the triples of the predicate for each triple.
+
+    Returns:
+        A list of results in the same format of the results of the masked language models.
+    """
+    candidates = sorted(
+        set(
+            [
+                obj_label
+                for triple in triples
+                for obj_label in (
+                    triple["obj_label"]
+                    if type(triple["obj_label"]) == list
+                    else [triple["obj_label"]]
+                )
+            ]
+        )
+    )
+
+    # The candidates follow the prompt that is either ending with a whitespace or a colon
+    prompt_template = PROMPTS[predicate][lang]
+    separator = "" if prompt_template[-1].isspace() or lang == "zh-cn" else " "
+    candidates_ids = [
+        tokenizer(separator + candidate, add_special_tokens=False)["input_ids"]
+        for candidate in candidates
+    ]
+
+    list_of_results = []
+    for triple in tqdm(triples):
+        scores = get_bloom_candidates_scores(
+            prompt_template.format(triple["sub_label"]),
+            candidates_ids,
+            model,
+            tokenizer,
+            device,
+            batch_size=batch_size,
+        )
+
+        objects_true = triple["obj_label"]
+        if type(objects_true) == type(""):
+            objects_true = [objects_true]
+
+        list_of_results.append(
+            {
+                "sample": triple,
+                "uuid": triple["uuid"],
+                "masked_topk": rank_candidates(
+                    candidates, np.array(scores), objects_true
+                ),
+            }
+        )
+    return list_of_results
+
+
 if __name__ == "__main__":
     parser = ArgumentParser("Probe bloom and bloomz models.")
     parser.add_argument(
@@ -161,6 +396,27 @@ if __name__ == "__main__":
         "-model_name", "-m", help="The name of the bloom(z) model to be probed."
     )
     parser.add_argument("--lang", help="Language of prompts to use")
+    parser.add_argument(
+        "--device", default="cuda", help="The device to load the model on (e.g.: cpu)."
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=8,
+        help="The number of prompts to complete (or candidates to score) at once.",
+    )
+    parser.add_argument(
+        "--mode",
+        default="generate",
+        choices=["generate", "rank"],
+        help="Generate free-form answers or rank the candidate objects by their log-likelihood.",
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=DEFAULT_TOP_K,
+        help="The number of top ranked candidates to store for each triple (rank mode).",
+    )
 
     args = parser.parse_args()
     model_name = args.model_name
@@ -175,7 +431,7 @@ if __name__ == "__main__":
 
     tokenizer = AutoTokenizer.from_pretrained(model_name)
     model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype="auto").to(
-        "cuda"
+        args.device
     )
 
     for predicate in tqdm(predicates):
@@ -188,13 +444,34 @@ if __name__ == "__main__":
             ],
             [],
         )
-        output_triples = get_bloom_predictions(
-            predicate, lang, model, tokenizer, triples
-        )
-
         PREDICATE_OUTPUT_DIR = str(Path(OUTPUT_DIR, predicate))
         os.makedirs(PREDICATE_OUTPUT_DIR, exist_ok=True)
 
+        if args.mode == "rank":
+            list_of_results = get_bloom_rankings(
+                predicate,
+                lang,
+                model,
+                tokenizer,
+                triples,
+                device=args.device,
+                batch_size=args.batch_size,
+            )
+
+            # Store the top predictions in the same format as the other models
+            write_results(PREDICATE_OUTPUT_DIR, list_of_results, top_k=args.top_k)
+            continue
+
+        output_triples = get_bloom_predictions(
+            predicate,
+            lang,
+            model,
+            tokenizer,
+            triples,
+            device=args.device,
+            batch_size=args.batch_size,
+        )
+
         predicate_output_file_path = str(
             Path(PREDICATE_OUTPUT_DIR, f"{predicate}.jsonl")
         )
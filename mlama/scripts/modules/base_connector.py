@@ -132,6 +132,25 @@ class Base_Connector:
     def get_batch_generation(self, sentences_list, logger=None, try_cuda=True):
         raise NotImplementedError()
 
+    def get_batch_masked_log_probs(
+        self, sentences_list, vocab_indices, logger=None, try_cuda=True
+    ):
+        """Compute the log probabilities of a subset of the vocabulary at the masked tokens only
+
+        Parameters:
+        sentences_list (list[list[string]]): list of elements. Each element is a list
+                                             that contains either a single sentence
+                                             or two sentences
+        vocab_indices (list[int]): the ids of the subset of the vocabulary
+
+        Returns:
+        log_probs (Tensor): a [sentences, max_masks, len(vocab_indices)] tensor padded
+                            for the sentences having fewer masked tokens
+        masked_indices_list (list[list[int]]): the indices of the masked tokens of
+                                               each sentence
+        """
+        raise NotImplementedError()
+
     def get_contextual_embeddings(self, sentences):
         """Compute the contextual embeddings of a list of sentences
 
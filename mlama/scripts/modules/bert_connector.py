@@ -73,10 +73,12 @@ class Bert(Base_Connector):
         # ... to get hidden states
         try:
             self.bert_model = self.masked_bert_model.bert
+            self.mlm_head = self.masked_bert_model.cls
             self.pad_id = self.inverse_vocab[self.tokenizer._pad_token]
             self.unk_index = self.inverse_vocab[self.tokenizer._unk_token]
         except:
             self.bert_model = self.masked_bert_model.roberta
+            self.mlm_head = self.masked_bert_model.lm_head
             self.pad_id = self.inverse_vocab[ROBERTA_PAD]
             self.unk_index = self.inverse_vocab[ROBERTA_UNK]
 
@@ -90,64 +92,41 @@ class Bert(Base_Connector):
         return indexed_string
 
     def __get_input_tensors_batch(self, sentences_list):
-        tokens_tensors_list = []
-        segments_tensors_list = []
+        indexed_tokens_list = []
+        segments_ids_list = []
         masked_indices_list = []
         tokenized_text_list = []
-        max_tokens = 0
         for sentences in sentences_list:
             (
-                tokens_tensor,
-                segments_tensor,
+                indexed_tokens,
+                segments_ids,
                 masked_indices,
                 tokenized_text,
             ) = self.__get_input_tensors(sentences)
-            tokens_tensors_list.append(tokens_tensor)
-            segments_tensors_list.append(segments_tensor)
+            indexed_tokens_list.append(indexed_tokens)
+            segments_ids_list.append(segments_ids)
             masked_indices_list.append(masked_indices)
             tokenized_text_list.append(tokenized_text)
-            # assert(tokens_tensor.shape[1] == segments_tensor.shape[1])
-            if tokens_tensor.shape[1] > max_tokens:
-                max_tokens = tokens_tensor.shape[1]
-        # print("MAX_TOKENS: {}".format(max_tokens))
-        # apply padding and concatenate tensors
+        max_tokens = max([len(indexed_tokens) for indexed_tokens in indexed_tokens_list])
+
+        # Allocate the padded tensors of the whole batch at once
         # use [PAD] for tokens and 0 for segments
-        final_tokens_tensor = None
-        final_segments_tensor = None
-        final_attention_mask = None
-        for tokens_tensor, segments_tensor in zip(
-            tokens_tensors_list, segments_tensors_list
+        batch_shape = (len(indexed_tokens_list), max_tokens)
+        final_tokens_tensor = torch.full(batch_shape, self.pad_id, dtype=torch.long)
+        final_segments_tensor = torch.zeros(batch_shape, dtype=torch.long)
+        final_attention_mask = torch.zeros(batch_shape, dtype=torch.long)
+        for i, (indexed_tokens, segments_ids) in enumerate(
+            zip(indexed_tokens_list, segments_ids_list)
         ):
-            dim_tensor = tokens_tensor.shape[1]
-            pad_lenght = max_tokens - dim_tensor
-            attention_tensor = torch.full([1, dim_tensor], 1, dtype=torch.long)
-            if pad_lenght > 0:
-                pad_1 = torch.full([1, pad_lenght], self.pad_id, dtype=torch.long)
-                pad_2 = torch.full([1, pad_lenght], 0, dtype=torch.long)
-                attention_pad = torch.full([1, pad_lenght], 0, dtype=torch.long)
-                tokens_tensor = torch.cat((tokens_tensor, pad_1), dim=1)
-                segments_tensor = torch.cat((segments_tensor, pad_2), dim=1)
-                attention_tensor = torch.cat((attention_tensor, attention_pad), dim=1)
-            if final_tokens_tensor is None:
-                final_tokens_tensor = tokens_tensor
-                final_segments_tensor = segments_tensor
-                final_attention_mask = attention_tensor
-            else:
-                final_tokens_tensor = torch.cat(
-                    (final_tokens_tensor, tokens_tensor), dim=0
-                )
-                final_segments_tensor = torch.cat(
-                    (final_segments_tensor, segments_tensor), dim=0
-                )
-                final_attention_mask = torch.cat(
-                    (final_attention_mask, attention_tensor), dim=0
-                )
-        # print(final_tokens_tensor)
-        # print(final_segments_tensor)
-        # print(final_attention_mask)
-        # print(final_tokens_tensor.shape)
-        # print(final_segments_tensor.shape)
-        # print(final_attention_mask.shape)
+            dim_tensor = len(indexed_tokens)
+            final_tokens_tensor[i, :dim_tensor] = torch.tensor(
+                indexed_tokens, dtype=torch.long
+            )
+            final_segments_tensor[i, :dim_tensor] = torch.tensor(
+                segments_ids, dtype=torch.long
+            )
+            final_attention_mask[i, :dim_tensor] = 1
+
         return (
             final_tokens_tensor,
             final_segments_tensor,
@@ -209,11 +188,8 @@ class Bert(Base_Connector):
 
         indexed_tokens = self.tokenizer.convert_tokens_to_ids(tokenized_text)
 
-        # Convert inputs to PyTorch tensors
-        tokens_tensor = torch.tensor([indexed_tokens])
-        segments_tensors = torch.tensor([segments_ids])
-
-        return tokens_tensor, segments_tensors, masked_indices, tokenized_text
+        # The tensors are formed for the whole batch
+        return indexed_tokens, segments_ids, masked_indices, tokenized_text
 
     def __get_token_ids_from_tensor(self, indexed_string):
         token_ids = []
@@ -259,6 +235,57 @@ class Bert(Base_Connector):
 
         return log_probs, token_ids_list, masked_indices_list
 
+    def get_batch_masked_log_probs(
+        self, sentences_list, vocab_indices, logger=None, try_cuda=True
+    ):
+        if not sentences_list:
+            return None
+        if try_cuda:
+            self.try_cuda()
+
+        (
+            tokens_tensor,
+            segments_tensor,
+            attention_mask_tensor,
+            masked_indices_list,
+            tokenized_text_list,
+        ) = self.__get_input_tensors_batch(sentences_list)
+
+        if logger is not None:
+            logger.debug("\n{}\n".format(tokenized_text_list))
+
+        # Pad the indices of the masked tokens of the sentences
+        max_masks = max([len(masked_indices) for masked_indices in masked_indices_list])
+        masked_positions = torch.zeros(
+            (len(masked_indices_list), max(1, max_masks)), dtype=torch.long
+        )
+        for i, masked_indices in enumerate(masked_indices_list):
+            masked_positions[i, : len(masked_indices)] = torch.tensor(
+                masked_indices, dtype=torch.long
+            )
+
+        with torch.no_grad():
+            hidden_states = self.bert_model(
+                input_ids=tokens_tensor.to(self._model_device),
+                token_type_ids=segments_tensor.to(self._model_device),
+                attention_mask=attention_mask_tensor.to(self._model_device),
+            )[0]
+            # Only apply the MLM head to the masked tokens
+            masked_hidden_states = hidden_states[
+                torch.arange(len(sentences_list), device=self._model_device)[:, None],
+                masked_positions.to(self._model_device),
+            ]
+            masked_logits = self.mlm_head(masked_hidden_states)
+            # The whole vocabulary is needed for normalizing the probabilities
+            log_probs = F.log_softmax(masked_logits, dim=-1).index_select(
+                dim=-1,
+                index=torch.as_tensor(
+                    vocab_indices, dtype=torch.long, device=self._model_device
+                ),
+            )
+
+        return log_probs.cpu(), masked_indices_list
+
     def get_contextual_embeddings(self, sentences_list, try_cuda=True):
 
         # assume in input 1 or 2 sentences - in general, it considers only the first 2 sentences
@@ -0,0 +1,446 @@
+import io
+import os
+import json
+import zlib
+import hashlib
+import pickle
+import struct
+import numpy as np
+from pathlib import Path
+
+# The columnar results of a relation (the pickle files are only read for older results)
+RESULTS_FILENAME = "result.npz"
+RESULTS_STREAM_FILENAME = "result.stream"
+LEGACY_RESULTS_FILENAME = "result.pkl"
+
+# A stream is a header (i.e.: the magic and a record of the fingerprint of the configuration)
+# followed by records of the columns of each batch of samples, and is terminated by a record of
+# the batches' offsets (i.e.: the index) and a trailer on closing
+STREAM_MAGIC = b"DLAMARS1"
+STREAM_TRAILER_MAGIC = b"DLAMAEND"
+CONFIG_RECORD = b"CONF"
+BATCH_RECORD = b"BTCH"
+INDEX_RECORD = b"INDX"
+# The kind, size and checksum of a record's payload
+RECORD_HEADER = struct.Struct("<4sQI")
+# The offset of the index record and the trailer magic
+STREAM_TRAILER = struct.Struct("<Q8s")
+
+# The number of top predictions stored for each sample
+DEFAULT_TOP_K = 10
+
+
+def flatten(lists, dtype):
+    """Concatenate a list of lists into an array along with the offsets of each list."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(l) for l in lists])
+    values = np.array([v for l in lists for v in l], dtype=dtype)
+    return values, offsets
+
+
+def unflatten(values, offsets):
+    """Split a flattened array back into a list of arrays."""
+    return [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+def logsumexp(scores):
+    max_score = np.max(scores)
+    return float(max_score + np.log(np.exp(scores - max_score).sum()))
+
+
+def results_to_columns(list_of_results, top_k=DEFAULT_TOP_K):
+    """Convert the results of a relation's samples into columns of numpy arrays.
+
+    Args:
+        list_of_results: A list of dictionaries of the "sample", the "uuid" and the "masked_topk"
+            ranking (i.e.: "ranks", "predicted" and "probs") of each sample.
+        top_k: The number of top predictions to keep for each sample.
+
+    Returns:
+        A dictionary of column name -> numpy array.
+    """
+    candidates = sorted(
+        set(
+            [o for result in list_of_results for o in result["masked_topk"]["predicted"]]
+        )
+    )
+    candidates_indices = {candidate: i for i, candidate in enumerate(candidates)}
+
+    n_samples = len(list_of_results)
+    # Samples having less than top_k candidates are padded with -1 and NaNs
+    predicted = np.full((n_samples, top_k), -1, dtype=np.int32)
+    probs = np.full((n_samples, top_k), np.nan, dtype=np.float32)
+    # The normalizer of the softmax over all the candidates' scores
+    log_normalizer = np.zeros(n_samples, dtype=np.float64)
+
+    for i, result in enumerate(list_of_results):
+        masked_topk = result["masked_topk"]
+        top_predicted = masked_topk["predicted"][:top_k]
+        predicted[i, : len(top_predicted)] = [
+            candidates_indices[o] for o in top_predicted
+        ]
+        probs[i, : len(top_predicted)] = masked_topk["probs"][:top_k]
+        log_normalizer[i] = logsumexp(np.array(masked_topk["probs"]))
+
+    obj_labels = [
+        result["sample"]["obj_label"]
+        if type(result["sample"]["obj_label"]) == list
+        else [result["sample"]["obj_label"]]
+        for result in list_of_results
+    ]
+    obj_labels, obj_labels_offsets = flatten(obj_labels, dtype=str)
+    ranks, ranks_offsets = flatten(
+        [result["masked_topk"]["ranks"] for result in list_of_results], dtype=np.int32
+    )
+    # The scores of the valid objects
+    prob_true, _ = flatten(
+        [
+            [result["masked_topk"]["probs"][r] for r in result["masked_topk"]["ranks"]]
+            for result in list_of_results
+        ],
+        dtype=np.float32,
+    )
+
+    return {
+        "uuid": np.array([result["uuid"] for result in list_of_results], dtype=str),
+        "sub_label": np.array(
+            [result["sample"]["sub_label"] for result in list_of_results], dtype=str
+        ),
+        "obj_labels": obj_labels,
+        "obj_labels_offsets": obj_labels_offsets,
+        "ranks": ranks,
+        "ranks_offsets": ranks_offsets,
+        "prob_true": prob_true,
+        "candidates": np.array(candidates, dtype=str),
+        "predicted": predicted,
+        "probs": probs,
+        "log_normalizer": log_normalizer,
+    }
+
+
+def concat_columns(batches_columns):
+    """Concatenate the columns of batches of samples into the columns of all the samples."""
+    if not batches_columns:
+        return results_to_columns([])
+
+    candidates = np.unique(
+        np.concatenate([columns["candidates"] for columns in batches_columns])
+    )
+    top_k = max([columns["predicted"].shape[1] for columns in batches_columns])
+
+    predicted = []
+    probs = []
+    for columns in batches_columns:
+        # Map the indices of the batch's candidates to the indices of all the candidates
+        batch_predicted = np.full(
+            (columns["predicted"].shape[0], top_k), -1, dtype=np.int32
+        )
+        batch_probs = np.full(batch_predicted.shape, np.nan, dtype=np.float32)
+        valid = columns["predicted"] >= 0
+        batch_predicted[:, : valid.shape[1]][valid] = np.searchsorted(
+            candidates, columns["candidates"][columns["predicted"][valid]]
+        )
+        batch_probs[:, : valid.shape[1]] = columns["probs"]
+        predicted.append(batch_predicted)
+        probs.append(batch_probs)
+
+    concatenated_columns = {
+        name: np.concatenate([columns[name] for columns in batches_columns])
+        for name in ["uuid", "sub_label", "log_normalizer"]
+    }
+    for name, offsets_name in [
+        ("obj_labels", "obj_labels_offsets"),
+        ("ranks", "ranks_offsets"),
+        ("prob_true", None),
+    ]:
+        concatenated_columns[name] = np.concatenate(
+            [columns[name] for columns in batches_columns]
+        )
+        if offsets_name:
+            # Shift the offsets of each batch by the size of the preceding batches
+            shifts = np.cumsum(
+                [0] + [columns[name].shape[0] for columns in batches_columns[:-1]]
+            )
+            concatenated_columns[offsets_name] = np.concatenate(
+                [np.zeros(1, dtype=np.int64)]
+                + [
+                    columns[offsets_name][1:] + shift
+                    for columns, shift in zip(batches_columns, shifts)
+                ]
+            )
+
+    concatenated_columns["candidates"] = candidates
+    concatenated_columns["predicted"] = np.concatenate(predicted)
+    concatenated_columns["probs"] = np.concatenate(probs)
+    return concatenated_columns
+
+
+def dump_columns(columns):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **columns)
+    return buffer.getvalue()
+
+
+def load_columns(payload):
+    with np.load(io.BytesIO(payload)) as data:
+        return {name: data[name] for name in data.files}
+
+
+def read_record(f):
+    """Read the (kind, payload) of the record at the current position (None if corrupted)."""
+    header = f.read(RECORD_HEADER.size)
+    if len(header) < RECORD_HEADER.size:
+        return None
+    kind, size, checksum = RECORD_HEADER.unpack(header)
+    # The size of a corrupted header can exceed the rest of the file
+    position = f.tell()
+    if size > f.seek(0, os.SEEK_END) - position:
+        return None
+    f.seek(position)
+    payload = f.read(size)
+    if len(payload) < size or zlib.crc32(payload) != checksum:
+        return None
+    return kind, payload
+
+
+def get_config_fingerprint(config):
+    """Hash a json-serializable configuration of the computation of the results."""
+    return hashlib.sha256(
+        json.dumps(config, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+def read_stream_fingerprint(f):
+    """Read the fingerprint stored in the header of a stream (None if missing)."""
+    f.seek(0)
+    if f.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        return None
+    record = read_record(f)
+    if record is None or record[0] != CONFIG_RECORD:
+        return None
+    return json.loads(record[1])["fingerprint"]
+
+
+def scan_batch_records(f):
+    """Yield the (offset, payload) of the batch records up to the index or a corrupted record."""
+    f.seek(0)
+    if f.read(len(STREAM_MAGIC)) != STREAM_MAGIC:
+        return
+    # The batches follow the configuration record of the header
+    record = read_record(f)
+    if record is None or record[0] != CONFIG_RECORD:
+        return
+    while True:
+        offset = f.tell()
+        record = read_record(f)
+        if record is None or record[0] != BATCH_RECORD:
+            return
+        yield offset, record[1]
+
+
+def read_stream_columns(file_path):
+    """Load the columns of all the batches of a results stream.
+
+    The index of a closed stream is used to locate the batches, while the batches of a stream that
+    wasn't closed (e.g.: a crashed run) are scanned up to the last complete one.
+    """
+    batches_columns = []
+    with open(str(file_path), "rb") as f:
+        batches_offsets = None
+        f.seek(0, os.SEEK_END)
+        if f.tell() >= len(STREAM_MAGIC) + STREAM_TRAILER.size:
+            f.seek(-STREAM_TRAILER.size, os.SEEK_END)
+            index_offset, magic = STREAM_TRAILER.unpack(f.read(STREAM_TRAILER.size))
+            if magic == STREAM_TRAILER_MAGIC:
+                f.seek(index_offset)
+                record = read_record(f)
+                if record is not None and record[0] == INDEX_RECORD:
+                    batches_offsets = json.loads(record[1])["batches_offsets"]
+
+        if batches_offsets is not None:
+            for offset in batches_offsets:
+                f.seek(offset)
+                record = read_record(f)
+                if record is None or record[0] != BATCH_RECORD:
+                    # Scan the batches up to the corrupted one instead
+                    batches_offsets = None
+                    break
+                batches_columns.append(load_columns(record[1]))
+
+        if batches_offsets is None:
+            batches_columns = [
+                load_columns(payload) for _, payload in scan_batch_records(f)
+            ]
+
+    return concat_columns(batches_columns)
+
+
+class ResultsStreamWriter:
+    """An append-only stream of the results of a relation, written batch by batch.
+
+    Each batch is committed to the disk as a checksummed record, so that the results of a crashed
+    run are kept up to its last complete batch and the run can be resumed from there.
+    """
+
+    def __init__(
+        self,
+        log_directory,
+        top_k=DEFAULT_TOP_K,
+        resume=True,
+        fingerprint=None,
+        logger=None,
+    ):
+        """
+        Args:
+            log_directory: The directory in which the stream is stored.
+            top_k: The number of top predictions to keep for each sample.
+            resume: Keep the batches of a previous run and append the new ones to them.
+            fingerprint: The fingerprint of the configuration of the run (see
+                get_config_fingerprint). The batches of a previous run are only kept if it
+                has the same fingerprint.
+            logger: The logger of the relation's run.
+        """
+        self.file_path = Path(log_directory, RESULTS_STREAM_FILENAME)
+        self.top_k = top_k
+        self.batches_offsets = []
+        # The uuids of the samples that are already stored
+        self.uuids = set()
+
+        if resume and self.file_path.exists():
+            self.file = open(str(self.file_path), "r+b")
+            end_offset = 0
+            if read_stream_fingerprint(self.file) == fingerprint:
+                for offset, payload in scan_batch_records(self.file):
+                    self.batches_offsets.append(offset)
+                    columns = load_columns(payload)
+                    self.uuids.update([str(uuid) for uuid in columns["uuid"]])
+                    end_offset = self.file.tell()
+            else:
+                msg = "{} was computed with a different configuration, ".format(
+                    self.file_path
+                ) + "so it is overwritten!"
+                if logger is not None:
+                    logger.warning(msg)
+                else:
+                    print("WARNING: {}".format(msg))
+
+            # Drop the index of a closed stream or the partial record of a crashed run
+            self.file.seek(end_offset)
+            self.file.truncate()
+        else:
+            self.file = open(str(self.file_path), "wb")
+
+        if not self.batches_offsets:
+            self.file.write(STREAM_MAGIC)
+            self.write_record(
+                CONFIG_RECORD, json.dumps({"fingerprint": fingerprint}).encode("utf-8")
+            )
+
+    def commit(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_record(self, kind, payload):
+        offset = self.file.tell()
+        self.file.write(RECORD_HEADER.pack(kind, len(payload), zlib.crc32(payload)))
+        self.file.write(payload)
+        self.commit()
+        return offset
+
+    def write_batch(self, list_of_results):
+        """Append the results of a batch of samples to the stream."""
+        if not list_of_results:
+            return
+        columns = results_to_columns(list_of_results, top_k=self.top_k)
+        self.batches_offsets.append(
+            self.write_record(BATCH_RECORD, dump_columns(columns))
+        )
+        self.uuids.update([result["uuid"] for result in list_of_results])
+
+    def close(self):
+        """Append the index of the batches to the stream and close it."""
+        index_offset = self.write_record(
+            INDEX_RECORD,
+            json.dumps({"batches_offsets": self.batches_offsets}).encode("utf-8"),
+        )
+        self.file.write(STREAM_TRAILER.pack(index_offset, STREAM_TRAILER_MAGIC))
+        self.commit()
+        self.file.close()
+
+
+def write_results(log_directory, list_of_results, top_k=DEFAULT_TOP_K):
+    """Store the top-k results of a relation as a compressed columnar file."""
+    columns = results_to_columns(list_of_results, top_k=top_k)
+    with open(str(Path(log_directory, RESULTS_FILENAME)), "wb") as f:
+        np.savez_compressed(f, **columns)
+
+
+def get_results_file_path(log_directory):
+    """Find the file of a relation's results (i.e.: the stream, the columnar or the pickle file)."""
+    for filename in [RESULTS_STREAM_FILENAME, RESULTS_FILENAME]:
+        file_path = Path(log_directory, filename)
+        if file_path.exists():
+            return file_path
+    return Path(log_directory, LEGACY_RESULTS_FILENAME)
+
+
+def read_columns(log_directory):
+    """Load the columns of a relation's results without decoding them (see results_to_columns)."""
+    file_path = get_results_file_path(log_directory)
+    if file_path.name == RESULTS_STREAM_FILENAME:
+        return read_stream_columns(file_path)
+
+    if file_path.name == RESULTS_FILENAME:
+        with np.load(str(file_path)) as data:
+            return {name: data[name] for name in data.files}
+
+    with open(str(file_path), "rb") as f:
+        list_of_results = pickle.load(f)["list_of_results"]
+    # The whole ranking of the legacy results is kept
+    top_k = max(
+        [len(result["masked_topk"]["predicted"]) for result in list_of_results],
+        default=0,
+    )
+    return results_to_columns(list_of_results, top_k=top_k)
+
+
+def decode_predictions(columns):
+    """Decode the top predictions of each sample and their softmax probabilities."""
+    candidates = columns["candidates"]
+    predicted = [
+        [str(candidates[i]) for i in row if i >= 0] for row in columns["predicted"]
+    ]
+    probabilities = [
+        np.exp(row[: len(row_predicted)] - normalizer)
+        for row, row_predicted, normalizer in zip(
+            columns["probs"].astype(np.float64), predicted, columns["log_normalizer"]
+        )
+    ]
+    return predicted, probabilities
+
+
+def read_results(log_directory):
+    """Load the results of a relation (from the columnar file, the stream or the pickle file).
+
+    Returns:
+        A dictionary of the "uuid", "sub_label", "obj_label" (lists of valid objects), "ranks"
+        (arrays of the valid objects' ranks), "predicted" (lists of the top predictions) and
+        "probabilities" (arrays of the softmax probabilities of the top predictions) of the
+        samples.
+    """
+    columns = read_columns(log_directory)
+    predicted, probabilities = decode_predictions(columns)
+
+    return {
+        "uuid": [str(uuid) for uuid in columns["uuid"]],
+        "sub_label": [str(label) for label in columns["sub_label"]],
+        "obj_label": [
+            [str(o) for o in obj_labels]
+            for obj_labels in unflatten(
+                columns["obj_labels"], columns["obj_labels_offsets"]
+            )
+        ],
+        "ranks": unflatten(columns["ranks"], columns["ranks_offsets"]),
+        "predicted": predicted,
+        "probabilities": probabilities,
+    }
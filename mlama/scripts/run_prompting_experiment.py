@@ -13,16 +13,15 @@ import sys
 from model_config import LANG_TO_LMs
 from utils import load_jsonl
 from eval_utils import run_evaluation
+from results_utils import write_results, DEFAULT_TOP_K
 from pathlib import Path
 import glob
 
 # T5 dependencies
 import os
 import re
-import pickle
-from tqdm import tqdm
 from transformers import T5Tokenizer, T5ForConditionalGeneration
-from eval_utils import get_T5_ranking
+from eval_utils import get_T5_answers_labels, get_T5_rankings, T5_MAX_BATCH_TOKENS
 
 
 def run_T5_experiments(
@@ -37,6 +36,8 @@ def run_T5_experiments(
         "T5_model_name": "google/mt5-small",
     },
     use_dlama=False,
+    max_batch_tokens=None,
+    top_k=DEFAULT_TOP_K,
 ):
     # Load the model
     model_name = input_param["T5_model_name"]
@@ -78,22 +79,33 @@ def run_T5_experiments(
             set([c for c_l in candidate_objects for c in c_l])
         )
 
+        # The candidate answers are only tokenized once for the relation
+        answers_labels = get_T5_answers_labels(tokenizer, unique_candidate_objects)
+
+        # Find the candidate answers probabilities for all the triples at once
         relation_template = relation["template"]
+        triples_answers_probabilities = get_T5_rankings(
+            model,
+            tokenizer,
+            unique_candidate_objects,
+            [
+                re.sub("[X]", triple["sub_label"], relation_template)
+                for triple in relation_triples
+            ],
+            device,
+            answers_labels=answers_labels,
+            max_batch_tokens=max_batch_tokens
+            if max_batch_tokens
+            else T5_MAX_BATCH_TOKENS,
+        )
+
         triples_results = []
-        for triple in tqdm(relation_triples):
+        for triple, answers_probabilities in zip(
+            relation_triples, triples_answers_probabilities
+        ):
             triple_results = {"sample": triple, "uuid": triple["uuid"]}
-            sub_label = triple["sub_label"]
             obj_labels = triple["obj_label"]
 
-            # Find the candidate answers probabilities for this triple
-            answers_probabilities = get_T5_ranking(
-                model,
-                tokenizer,
-                unique_candidate_objects,
-                re.sub("[X]", sub_label, relation_template),
-                device,
-            )
-
             # Sort the answers
             sorted_answers_probabilities = sorted(
                 [
@@ -124,10 +136,8 @@ def run_T5_experiments(
         )
         os.makedirs(log_directory, exist_ok=True)
 
-        # Dump the results to a .pkl file
-        with open("{}/result.pkl".format(log_directory), "wb") as f:
-            output_dict = {"list_of_results": triples_results}
-            pickle.dump(output_dict, f)
+        # Store the top predictions of the relation
+        write_results(log_directory, triples_results, top_k=top_k)
 
 
 def run_experiments(
@@ -143,6 +153,10 @@ def run_experiments(
         "bert_model_dir": "pre-trained_language_models/bert/cased_L-24_H-1024_A-16",
     },
     use_dlama=False,
+    batch_size=4,
+    max_batch_tokens=None,
+    top_k=DEFAULT_TOP_K,
+    resume=True,
 ):
     """
     TODO
@@ -164,7 +178,13 @@ def run_experiments(
     # Add the configuration parameters into a dictionary
     BASIC_CONFIGURATION_PARAMETERS = {
         "template": "",
-        "batch_size": 4,
+        "batch_size": batch_size,
+        # Fill the batches up to a number of tokens instead of a number of samples
+        "max_batch_tokens": max_batch_tokens,
+        # The number of top predictions stored for each sample
+        "top_k": top_k,
+        # Skip the samples that were stored by a previous run of the relation
+        "resume": resume,
         "logdir": LOGDIR,
         "lowercase": False,
         "threads": -1,
@@ -239,11 +259,20 @@ def run_experiments(
 
         # Run the experiments
         # TODO: Don't send the whole args dictionary
-        run_evaluation(args, max_length, dict_num_mask, model=model)
+        run_evaluation(args, dict_num_mask, model=model)
 
 
 def run_experiment_on_list_of_lms(
-    relations_templates, data_path_pre, language, language_models, use_dlama, device
+    relations_templates,
+    data_path_pre,
+    language,
+    language_models,
+    use_dlama,
+    device,
+    batch_size=4,
+    max_batch_tokens=None,
+    top_k=DEFAULT_TOP_K,
+    resume=True,
 ):
     for lm in language_models:
         print(lm["label"])
@@ -256,6 +285,8 @@ def run_experiment_on_list_of_lms(
                     input_param=lm,
                     use_dlama=use_dlama,
                     device=device,
+                    max_batch_tokens=max_batch_tokens,
+                    top_k=top_k,
                 )
             else:
                 run_experiments(
@@ -265,6 +296,10 @@ def run_experiment_on_list_of_lms(
                     input_param=lm,
                     use_dlama=use_dlama,
                     device=device,
+                    batch_size=batch_size,
+                    max_batch_tokens=max_batch_tokens,
+                    top_k=top_k,
+                    resume=resume,
                 )
         except Exception as e:
             print(e)
@@ -300,6 +335,31 @@ def main():
     parser.add_argument(
         "--device", required=False, default="cpu", help="GPU's device ID to use",
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=4,
+        help="The number of samples within each batch",
+    )
+    parser.add_argument(
+        "--max_batch_tokens",
+        type=int,
+        default=None,
+        help="Group the samples by their number of tokens and fill each batch up to this number "
+        "of tokens across all its templates (overrides --batch_size). For T5 models, the "
+        "maximum number of decoder tokens of a batch of (prompt, answer) pairs",
+    )
+    parser.add_argument(
+        "--top_k",
+        type=int,
+        default=DEFAULT_TOP_K,
+        help="The number of top ranked candidates to store for each sample",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Re-score the samples stored by a previous run instead of resuming it",
+    )
 
     args = parser.parse_args()
     language = args.lang
@@ -330,6 +390,10 @@ def main():
         language_models,
         use_dlama=args.dlama,
         device=args.device,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        top_k=args.top_k,
+        resume=not args.overwrite,
     )
 
 
@@ -89,6 +89,41 @@ def batchify(data, batch_size):
     return list_samples_batches
 
 
+def batchify_by_tokens(data, max_batch_tokens, get_num_tokens):
+    """Split the data into batches whose number of padded tokens is within a budget.
+
+    Args:
+        data: A list of samples.
+        max_batch_tokens: The maximum number of tokens of a batch (including the padding tokens).
+        get_num_tokens: A function returning the number of tokens of a sample.
+
+    Returns:
+        A list of batches of samples.
+    """
+    # sort to group together sentences with similar number of tokens
+    samples_lengths = sorted(
+        [(get_num_tokens(sample), i) for i, sample in enumerate(data)]
+    )
+
+    list_samples_batches = []
+    batch = []
+    batch_max_length = 0
+    for length, i in samples_lengths:
+        # All the samples of a batch are padded to the longest one
+        padded_batch_tokens = max(batch_max_length, length) * (len(batch) + 1)
+        if batch and padded_batch_tokens > max_batch_tokens:
+            list_samples_batches.append(batch)
+            batch = []
+            batch_max_length = 0
+        batch.append(data[i])
+        batch_max_length = max(batch_max_length, length)
+
+    if batch:
+        list_samples_batches.append(batch)
+
+    return list_samples_batches
+
+
 def fill_template_with_values(template, subject_label, object_label):
     """Fill template with a subject/object from a triple"""
     template = template.replace("[X]", subject_label)
@@ -3,7 +3,7 @@ import glob
 import pandas as pd
 from pathlib import Path
 from natsort import natsorted
-from metrics_utils import load_model_results, compute_P_scores
+from metrics_utils import get_results_catalog, compute_P_scores
 from dataset_analysis_utils import (
     compute_entropy,
     normalize_region_name,
@@ -14,26 +14,33 @@ from dataset_analysis_utils import (
 )
 
 #  TODO: Merge these functions into 1
-def generate_stats_table(results_dir, lang, aggregation_method):
+def generate_stats_table(results_dir, lang, aggregation_method, max_workers=None):
     """
     Generate a list of the overall performance of models for prompts of a specific language as in Table 1,2.
     """
     models_names = [
         Path(p).parent.name for p in glob.glob(str(Path(results_dir, "*", lang)))
     ]
+    # The results of all the models are loaded concurrently (and only once per process)
+    catalog = get_results_catalog(results_dir)
+    results_df = catalog.load_results(models_names, [lang], max_workers=max_workers)
+    models_results_dfs = dict(tuple(results_df.groupby("model_name", sort=False)))
+
     model_results = []
     for model_name in models_names:
-        results_df = load_model_results(results_dir, model_name=model_name, lang=lang)
-        scores = compute_P_scores(results_df, aggregation_method=aggregation_method)
+        scores = compute_P_scores(
+            models_results_dfs[model_name], aggregation_method=aggregation_method
+        )
         scores["model_name"] = model_name
         model_results.append(scores)
     return sorted(model_results, key=lambda d: d["P@1_aggregated"])
 
 
-def generate_detailed_predicate_table(results_dir, lang, model_name):
+def generate_detailed_predicate_table(results_dir, lang, model_name, max_workers=None):
     model_results = []
 
-    results_df = load_model_results(results_dir, model_name=model_name, lang=lang)
+    catalog = get_results_catalog(results_dir)
+    results_df = catalog.load_results([model_name], [lang], max_workers=max_workers)
     scores = compute_P_scores(results_df, aggregation_method="split_by_domain")
 
     model_results.append(scores)